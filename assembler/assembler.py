@@ -1,3 +1,10 @@
+import json
+import mmap
+import os
+import sys
+from array import array
+from functools import lru_cache
+
 def read_file(filename):
     with open(filename, 'r') as file:
         lines = file.readlines()
@@ -13,15 +20,20 @@ def parse_lines(lines):
         parsed_lines.append(line)
     return parsed_lines
 
+PREDEFINED_SYMBOLS = {
+    'R0': 0, 'R1': 1, 'R2': 2, 'R3': 3, 'R4': 4, 'R5': 5, 'R6': 6, 'R7': 7, 
+    'R8': 8, 'R9': 9, 'R10': 10, 'R11': 11, 'R12': 12, 'R13': 13, 'R14': 14, 'R15': 15,
+    'SCREEN': 16384, 'KBD': 24576, 'SP': 0, 'LCL': 1, 'ARG': 2, 'THIS': 3, 'THAT': 4
+}
+
+MAX_A_VALUE = 0x7FFF # the value of an A-instruction has 15 bits, the 16th tells it from a C-instruction
+
+def a_value_error(line, value, rom_address):
+    return ValueError(f"{line}: {value} does not fit in an A-instruction (0 to {MAX_A_VALUE}), at ROM address {rom_address}")
+
 def first_pass(lines):
 
-    symbol_table = {"RAM addresses":
-        {
-            'R0': 0, 'R1': 1, 'R2': 2, 'R3': 3, 'R4': 4, 'R5': 5, 'R6': 6, 'R7': 7, 
-            'R8': 8, 'R9': 9, 'R10': 10, 'R11': 11, 'R12': 12, 'R13': 13, 'R14': 14, 'R15': 15,
-            'SCREEN': 16384, 'KBD': 24576, 'SP': 0, 'LCL': 1, 'ARG': 2, 'THIS': 3, 'THAT': 4
-        }, "ROM addresses": {}
-    }
+    symbol_table = {"RAM addresses": dict(PREDEFINED_SYMBOLS), "ROM addresses": {}}
 
     rom_address = 0
     for line in lines:
@@ -32,6 +44,72 @@ def first_pass(lines):
             rom_address += 1
     return symbol_table
 
+COMP_TABLE = {
+    '0':   '0101010', '1':   '0111111', '-1':  '0111010',
+    'D':   '0001100', 'A':   '0110000', '!D':  '0001101', '!A':  '0110001',
+    '-D':  '0001111', '-A':  '0110011', 'D+1': '0011111', 'A+1': '0110111',
+    'D-1': '0001110', 'A-1': '0110010', 'D+A': '0000010', 'D-A': '0010011',
+    'A-D': '0000111', 'D&A': '0000000', 'D|A': '0010101',
+    'M':   '1110000', '!M':  '1110001', '-M':  '1110011', 'M+1': '1110111',
+    'M-1': '1110010', 'D+M': '1000010', 'D-M': '1010011', 'M-D': '1000111',
+    'D&M': '1000000', 'D|M': '1010101',
+    # commutative spellings, as emitted by the VM translator (e.g. M=M+D)
+    'A+D': '0000010', 'A&D': '0000000', 'A|D': '0010101',
+    'M+D': '1000010', 'M&D': '1000000', 'M|D': '1010101'
+}
+
+DEST_TABLE = {
+    None: '000', 'M': '001', 'D': '010', 'MD': '011', 'A': '100', 'AM': '101',
+    'AD': '110', 'AMD': '111'
+}
+
+JUMP_TABLE = {
+    None: '000', 'JGT': '001', 'JEQ': '010', 'JGE': '011', 'JLT': '100',
+    'JNE': '101', 'JLE': '110', 'JMP': '111'
+}
+
+def _build_c_instruction_table():
+    # every legal dest=comp;jump combination, spelled the canonical way (no whitespace)
+    table = {}
+    for dest, dest_bits in DEST_TABLE.items():
+        for comp, comp_bits in COMP_TABLE.items():
+            for jump, jump_bits in JUMP_TABLE.items():
+                instruction = comp
+                if dest is not None:
+                    instruction = dest + '=' + instruction
+                if jump is not None:
+                    instruction = instruction + ';' + jump
+                table[instruction] = '111' + comp_bits + dest_bits + jump_bits
+    return table
+
+C_INSTRUCTION_TABLE = _build_c_instruction_table()
+
+def c_instruction_error(instruction):
+    # names the parts of a C-instruction that are not in the tables
+    dest, equals, rest = ''.join(instruction.split()).partition('=')
+    if not equals:
+        dest, rest = None, dest
+    comp, semicolon, jump = rest.partition(';')
+    unknown = [f"{part} '{value}'" for part, value, table in
+               (('dest', dest, DEST_TABLE), ('comp', comp, COMP_TABLE), ('jump', jump if semicolon else None, JUMP_TABLE))
+               if value not in table]
+    return ValueError(f"invalid C-instruction '{instruction}': unknown {' and '.join(unknown) or 'format'}")
+
+@lru_cache(maxsize=1024)
+def _translate_unnormalized_c_instruction(instruction):
+    # only reached for spellings that are not in the table as-is, e.g. 'D = M' or 'D;  JGT';
+    # unlike the encoder before the table, an unknown dest is an error instead of '000'
+    bits = C_INSTRUCTION_TABLE.get(''.join(instruction.split()))
+    if bits is None:
+        raise c_instruction_error(instruction)
+    return bits
+
+def translate_c_instruction(instruction):
+    bits = C_INSTRUCTION_TABLE.get(instruction)
+    if bits is None:
+        bits = _translate_unnormalized_c_instruction(instruction)
+    return bits
+
 def second_pass(lines, symbol_table):
     next_variable_address = 16 # variables refer to an address in the RAM
     binary_code = []
@@ -50,48 +128,11 @@ def second_pass(lines, symbol_table):
                 symbol_table["RAM addresses"][symbol] = next_variable_address
                 next_variable_address += 1
                 address = symbol_table["RAM addresses"][symbol]
+        if address > MAX_A_VALUE:
+            raise a_value_error(line, address, len(binary_code))
         address = format(address, '016b')
         return address
     
-    def translate_c_instruction(instruction):
-        comp_table = {
-            '0':   '0101010', '1':   '0111111', '-1':  '0111010',
-            'D':   '0001100', 'A':   '0110000', '!D':  '0001101', '!A':  '0110001',
-            '-D':  '0001111', '-A':  '0110011', 'D+1': '0011111', 'A+1': '0110111',
-            'D-1': '0001110', 'A-1': '0110010', 'D+A': '0000010', 'D-A': '0010011',
-            'A-D': '0000111', 'D&A': '0000000', 'D|A': '0010101',
-            'M':   '1110000', '!M':  '1110001', '-M':  '1110011', 'M+1': '1110111',
-            'M-1': '1110010', 'D+M': '1000010', 'D-M': '1010011', 'M-D': '1000111',
-            'D&M': '1000000', 'D|M': '1010101'
-        }
-
-        dest_table = {
-            None: '000', 'M': '001', 'D': '010', 'MD': '011', 'A': '100', 'AM': '101',
-            'AD': '110', 'AMD': '111'
-        }
-
-        jump_table = {
-            None: '000', 'JGT': '001', 'JEQ': '010', 'JGE': '011', 'JLT': '100',
-            'JNE': '101', 'JLE': '110', 'JMP': '111'
-        }
-
-        dest, comp, jump = None, None, None
-        if '=' in instruction:
-            parts = instruction.split('=')
-            dest = parts[0].strip()
-            instruction = parts[1].strip()
-        if ';' in instruction:
-            parts = instruction.split(';')
-            comp = parts[0].strip()
-            jump = parts[1].strip()
-        else:
-            comp = instruction.strip()
-        
-        dest_bits = dest_table.get(dest, '000')
-        comp_bits = comp_table[comp]
-        jump_bits = jump_table.get(jump, '000')
-        return ('111' + comp_bits + dest_bits + jump_bits)
-
     for line in lines:
         if line.startswith('(') and line.endswith(')'):
             continue
@@ -101,26 +142,180 @@ def second_pass(lines, symbol_table):
             binary_code.append(translate_c_instruction(line))
     return binary_code
 
-def write_file(filename, binary_code):
+def stream_lines(filename):
+    # same cleanup as parse_lines, but yields one line at a time instead of building a list
+    with open(filename, 'r') as file:
+        for line in file:
+            line = line.strip()
+            if not line or line.startswith('//'):
+                continue
+            yield line.split('//')[0].strip() # remove inline comments
+
+def stream_assemble(input_filename, output_filename):
+    # Single pass: every instruction is written as soon as it is read. An A-instruction whose
+    # symbol is not known yet gets a placeholder line holding (as 16 decimal digits) the ROM
+    # address + 1 of the previous unresolved use of the same symbol, so each symbol only keeps
+    # the head of its chain in memory. The chains are walked and patched once the input ends.
+    line_width = 17 # 16 bits + '\n'
+    labels = {}
+    pending = {} # symbol -> ROM address + 1 of its latest unresolved use (insertion order = first use)
+    rom_address = 0
+    with open(output_filename, 'wb+') as file:
+        for line in stream_lines(input_filename):
+            if line.startswith('(') and line.endswith(')'):
+                labels[line[1:-1]] = rom_address
+                continue
+            if line.startswith('@'):
+                symbol = line[1:]
+                if symbol.isdigit():
+                    if int(symbol) > MAX_A_VALUE:
+                        raise a_value_error(line, int(symbol), rom_address)
+                    bits = format(int(symbol), '016b')
+                elif symbol in PREDEFINED_SYMBOLS:
+                    bits = format(PREDEFINED_SYMBOLS[symbol], '016b')
+                elif symbol in labels:
+                    if labels[symbol] > MAX_A_VALUE:
+                        raise a_value_error(line, labels[symbol], rom_address)
+                    bits = format(labels[symbol], '016b')
+                else:
+                    bits = format(pending.get(symbol, 0), '016d')
+                    pending[symbol] = rom_address + 1
+            else:
+                bits = translate_c_instruction(line)
+            file.write((bits + '\n').encode())
+            rom_address += 1
+
+        next_variable_address = 16 # variables refer to an address in the RAM
+        for symbol, link in pending.items():
+            if symbol in labels:
+                address = labels[symbol]
+            else: # symbol is a variable
+                address = next_variable_address
+                next_variable_address += 1
+            if address > MAX_A_VALUE:
+                raise a_value_error('@' + symbol, address, link - 1)
+            bits = format(address, '016b').encode()
+            while link:
+                file.seek((link - 1) * line_width)
+                next_link = int(file.read(16))
+                file.seek((link - 1) * line_width)
+                file.write(bits)
+                link = next_link
+
+OUTPUT_FORMATS = {'hack': '.hack', 'bin': '.bin', 'mmap': '.bin'}
+SOURCE_MAP_MARKER = '//@ ' # written by the VM translator with --map: '//@ file line function command'
+
+def build_source_map(lines):
+    # Source map of raw assembly lines (comments included): the ROM address range of every
+    # marker, as {'files': [...], 'functions': [...], 'commands': [...], 'ranges': [...]} where
+    # ranges is a flat list of (first ROM address, file, line, function, command) with indexes
+    # into the name lists. A range ends where the next one starts.
+    names = {'files': {}, 'functions': {}, 'commands': {}}
+    ranges = []
+    rom_address = 0
+    for line in lines:
+        line = line.strip()
+        if line.startswith(SOURCE_MAP_MARKER):
+            file, line_number, function, command = line[len(SOURCE_MAP_MARKER):].split(' ', 3)
+            if ranges and ranges[-5] == rom_address:
+                del ranges[-5:] # the previous marker produced no instructions
+            ranges.extend((
+                rom_address,
+                names['files'].setdefault(file, len(names['files'])),
+                int(line_number),
+                names['functions'].setdefault(function, len(names['functions'])),
+                names['commands'].setdefault(command, len(names['commands']))
+            ))
+            continue
+        line = line.split('//')[0].strip()
+        if line and not (line.startswith('(') and line.endswith(')')):
+            rom_address += 1
+    return {'files': list(names['files']), 'functions': list(names['functions']),
+            'commands': list(names['commands']), 'ranges': ranges, 'size': rom_address}
+
+def write_source_map(filename, source_map):
     with open(filename, 'w') as file:
-        for line in binary_code:
-            file.write(line + '\n')
+        json.dump(source_map, file, separators=(',', ':'))
 
-def main():
-    import sys
-    import os
+def pack_words(binary_code):
+    # one uint16 per instruction; every output format is produced from this buffer
+    return array('H', [int(line, 2) for line in binary_code])
 
-    if len(sys.argv) != 2:
-        print("Usage: python3 assembler.py filename.asm")
-        return
-    input_filename = sys.argv[1]
-    basename = os.path.splitext(input_filename)[0]
-    output_filename = basename + '.hack'
+def _little_endian_bytes(words):
+    if sys.byteorder == 'big':
+        words = array('H', words)
+        words.byteswap()
+    return words.tobytes()
+
+def write_hack(filename, words):
+    text = '\n'.join([format(word, '016b') for word in words])
+    with open(filename, 'w') as file:
+        file.write(text + '\n' if words else '')
+
+def write_bin(filename, words):
+    with open(filename, 'wb') as file:
+        file.write(_little_endian_bytes(words))
+
+def write_mmap(filename, words):
+    data = _little_endian_bytes(words)
+    with open(filename, 'wb+') as file:
+        file.truncate(len(data)) # preallocate, then copy the image straight into the mapping
+        if not data: # an empty file cannot be mapped
+            return
+        with mmap.mmap(file.fileno(), len(data)) as image:
+            image[:] = data
+
+def write_file(filename, binary_code, output_format='hack'):
+    words = pack_words(binary_code)
+    if output_format == 'hack':
+        write_hack(filename, words)
+    elif output_format == 'bin':
+        write_bin(filename, words)
+    elif output_format == 'mmap':
+        write_mmap(filename, words)
+    else:
+        raise ValueError(f"unknown output format: {output_format}")
+
+def output_filename_for(input_filename, output_format='hack'):
+    return os.path.splitext(input_filename)[0] + OUTPUT_FORMATS[output_format]
+
+def assemble_file(input_filename, output_format='hack', stream=False, source_map=False):
+    # with source_map, the source map of the program is written to a .map file as well
+    output_filename = output_filename_for(input_filename, output_format)
+    if stream:
+        stream_assemble(input_filename, output_filename)
+        return output_filename
     lines = read_file(input_filename)
+    if source_map:
+        write_source_map(os.path.splitext(input_filename)[0] + '.map', build_source_map(lines))
     parsed_lines = parse_lines(lines)
     symbol_table = first_pass(parsed_lines)
     binary_code = second_pass(parsed_lines, symbol_table)
-    write_file(output_filename, binary_code)
+    write_file(output_filename, binary_code, output_format)
+    return output_filename
+
+def main():
+    usage = "Usage: python3 assembler.py [--stream | --format=hack|bin|mmap] [--map] filename.asm"
+    args = sys.argv[1:]
+    stream = '--stream' in args
+    if stream:
+        args.remove('--stream')
+    source_map = '--map' in args
+    if source_map:
+        args.remove('--map')
+    output_format = 'hack'
+    for arg in list(args):
+        if arg.startswith('--format='):
+            output_format = arg.split('=', 1)[1]
+            args.remove(arg)
+    if len(args) != 1 or output_format not in OUTPUT_FORMATS or (stream and (output_format != 'hack' or source_map)):
+        print(usage)
+        return
+    try:
+        assemble_file(args[0], output_format, stream, source_map)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
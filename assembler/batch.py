@@ -0,0 +1,81 @@
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from assembler import OUTPUT_FORMATS, assemble_file, output_filename_for
+
+def collect_files(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(os.path.join(root, name) for name in names if name.endswith('.asm'))
+        elif os.path.isfile(path):
+            files.append(path)
+        else:
+            print(f"no file or folder found: {path}")
+    return sorted(files)
+
+def is_up_to_date(input_filename, output_format):
+    output_filename = output_filename_for(input_filename, output_format)
+    return os.path.exists(output_filename) and os.path.getmtime(output_filename) >= os.path.getmtime(input_filename)
+
+def assemble_job(input_filename, output_format):
+    # runs in a worker process; errors are reported back instead of raised so the batch keeps going
+    start = time.perf_counter()
+    try:
+        assemble_file(input_filename, output_format)
+        error = None
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    return input_filename, time.perf_counter() - start, error
+
+def run_batch(paths, output_format='hack', workers=None, force=False):
+    files = collect_files(paths)
+    jobs, skipped = [], []
+    for file in files:
+        if force or not is_up_to_date(file, output_format):
+            jobs.append(file)
+        else:
+            skipped.append(file)
+    results = {'assembled': [], 'skipped': skipped, 'failed': []}
+    if not jobs:
+        return results
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for input_filename, elapsed, error in executor.map(assemble_job, jobs, [output_format] * len(jobs)):
+            if error is None:
+                results['assembled'].append((input_filename, elapsed))
+                print(f"{elapsed * 1000:9.1f} ms  {input_filename}")
+            else:
+                results['failed'].append((input_filename, error))
+                print(f"{'FAILED':>12}  {input_filename}: {error}")
+    return results
+
+def main():
+    usage = "Usage: python3 batch.py [--force] [--jobs=N] [--format=hack|bin|mmap] path [path ...]"
+    args = sys.argv[1:]
+    force = '--force' in args
+    if force:
+        args.remove('--force')
+    output_format, workers = 'hack', None
+    for arg in list(args):
+        if arg.startswith('--format='):
+            output_format = arg.split('=', 1)[1]
+            args.remove(arg)
+        elif arg.startswith('--jobs='):
+            workers = int(arg.split('=', 1)[1])
+            args.remove(arg)
+    if not args or output_format not in OUTPUT_FORMATS:
+        print(usage)
+        return
+    start = time.perf_counter()
+    results = run_batch(args, output_format, workers, force)
+    elapsed = time.perf_counter() - start
+    print(f"{len(results['assembled'])} assembled, {len(results['skipped'])} up to date, "
+          f"{len(results['failed'])} failed in {elapsed:.2f} s")
+    if results['failed']:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
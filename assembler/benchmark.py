@@ -0,0 +1,74 @@
+import sys
+import timeit
+
+from assembler import translate_c_instruction
+
+# the C-instruction mix produced by the VM translator, repeated over and over in real programs;
+# M=D+M, M=D&M and M=D|M are spelled the way the original encoder's table has them
+INSTRUCTIONS = [
+    'D=A', 'D=M', 'A=M', 'M=D', 'M=M+1', 'AM=M-1', 'A=A-1', 'M=D+M', 'M=M-D', 'M=D&M',
+    'M=D|M', 'M=!M', 'M=-M', 'D=M-D', 'D;JEQ', 'D;JGT', 'D;JLT', 'D;JNE', 'M=0', 'M=-1',
+    '0;JMP', 'A=D+A', 'D=D+A', 'D=M+1', 'D=A-D', 'A=D-A', 'AM=M+1', 'D = M', 'D;  JGT'
+]
+
+def legacy_translate_c_instruction(instruction):
+    # the encoder of the original assembler, unchanged (tables built on every call, then the
+    # instruction split into dest, comp and jump), kept for comparison
+    comp_table = {
+        '0':   '0101010', '1':   '0111111', '-1':  '0111010',
+        'D':   '0001100', 'A':   '0110000', '!D':  '0001101', '!A':  '0110001',
+        '-D':  '0001111', '-A':  '0110011', 'D+1': '0011111', 'A+1': '0110111',
+        'D-1': '0001110', 'A-1': '0110010', 'D+A': '0000010', 'D-A': '0010011',
+        'A-D': '0000111', 'D&A': '0000000', 'D|A': '0010101',
+        'M':   '1110000', '!M':  '1110001', '-M':  '1110011', 'M+1': '1110111',
+        'M-1': '1110010', 'D+M': '1000010', 'D-M': '1010011', 'M-D': '1000111',
+        'D&M': '1000000', 'D|M': '1010101'
+    }
+
+    dest_table = {
+        None: '000', 'M': '001', 'D': '010', 'MD': '011', 'A': '100', 'AM': '101',
+        'AD': '110', 'AMD': '111'
+    }
+
+    jump_table = {
+        None: '000', 'JGT': '001', 'JEQ': '010', 'JGE': '011', 'JLT': '100',
+        'JNE': '101', 'JLE': '110', 'JMP': '111'
+    }
+
+    dest, comp, jump = None, None, None
+    if '=' in instruction:
+        parts = instruction.split('=')
+        dest = parts[0].strip()
+        instruction = parts[1].strip()
+    if ';' in instruction:
+        parts = instruction.split(';')
+        comp = parts[0].strip()
+        jump = parts[1].strip()
+    else:
+        comp = instruction.strip()
+    
+    dest_bits = dest_table.get(dest, '000')
+    comp_bits = comp_table[comp]
+    jump_bits = jump_table.get(jump, '000')
+    return ('111' + comp_bits + dest_bits + jump_bits)
+
+def run(encoder, repeat):
+    for _ in range(repeat):
+        for instruction in INSTRUCTIONS:
+            encoder(instruction)
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    for instruction in INSTRUCTIONS:
+        assert translate_c_instruction(instruction) == legacy_translate_c_instruction(instruction), instruction
+
+    count = repeat * len(INSTRUCTIONS)
+    legacy = min(timeit.repeat(lambda: run(legacy_translate_c_instruction, repeat), number=1, repeat=3))
+    table = min(timeit.repeat(lambda: run(translate_c_instruction, repeat), number=1, repeat=3))
+    print(f"instructions encoded: {count}")
+    print(f"legacy encoder: {legacy / count * 1e9:8.1f} ns/instruction")
+    print(f"table encoder:  {table / count * 1e9:8.1f} ns/instruction")
+    print(f"speedup:        {legacy / table:8.1f}x")
+
+if __name__ == "__main__":
+    main()
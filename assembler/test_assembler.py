@@ -0,0 +1,33 @@
+import os
+import tempfile
+import unittest
+
+from assembler import assemble_file, translate_c_instruction
+
+class CInstructionTest(unittest.TestCase):
+    # an instruction that is not in the tables is an error that names it, never a guessed encoding
+
+    def test_unknown_parts_are_named(self):
+        for instruction, message in (('X=D', "unknown dest 'X'"), ('D=Q', "unknown comp 'Q'"),
+                                     ('D;JXX', "unknown jump 'JXX'")):
+            with self.assertRaises(ValueError) as context:
+                translate_c_instruction(instruction)
+            self.assertIn(f"'{instruction}'", str(context.exception))
+            self.assertIn(message, str(context.exception))
+
+    def test_other_spellings_are_encoded(self):
+        self.assertEqual(translate_c_instruction('D = M'), translate_c_instruction('D=M'))
+        self.assertEqual(translate_c_instruction('M=M+D'), translate_c_instruction('M=D+M'))
+        self.assertEqual(translate_c_instruction('D;  JGT'), '1110001100000001')
+
+    def test_no_output_for_an_invalid_program(self):
+        with tempfile.TemporaryDirectory() as directory:
+            asm_filename = os.path.join(directory, 'Bad.asm')
+            with open(asm_filename, 'w') as file:
+                file.write('@2\nD=A\nX=D\n')
+            with self.assertRaises(ValueError):
+                assemble_file(asm_filename)
+            self.assertFalse(os.path.exists(os.path.join(directory, 'Bad.hack')))
+
+if __name__ == "__main__":
+    unittest.main()
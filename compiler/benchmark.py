@@ -0,0 +1,101 @@
+import importlib.util
+import io
+import random
+import sys
+import time
+
+import symbol_table
+from code_writer import CodeWriter
+
+def generate_class(name='Big', fields=200, subroutines=100, locals_count=60, statements=80, seed=0):
+    # a deterministic, identifier-heavy Jack class: many fields and locals, and long expressions
+    # that mix them, so compiling it is dominated by variable lookups
+    rng = random.Random(seed)
+    lines = [f'class {name} {{\n']
+    field_names = [f'field{i}' for i in range(fields)]
+    lines.append(f'    field int {", ".join(field_names)};\n')
+    for s in range(subroutines):
+        local_names = [f'v{i}' for i in range(locals_count)]
+        visible = field_names + local_names + ['a', 'b']
+        lines.append(f'    method int m{s}(int a, int b) {{\n')
+        lines.append(f'        var int {", ".join(local_names)};\n')
+        for _ in range(statements):
+            terms = [rng.choice(visible) for _ in range(6)]
+            ops = [rng.choice('+-&|') for _ in range(5)]
+            expression = terms[0] + ''.join(f' {op} {term}' for op, term in zip(ops, terms[1:]))
+            lines.append(f'        let {rng.choice(local_names)} = {expression};\n')
+        lines.append('        return a;\n    }\n')
+    lines.append('}\n')
+    return ''.join(lines)
+
+def load_module(path):
+    spec = importlib.util.spec_from_file_location('baseline_symbol_table', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def best_of(function, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def measure_lookups(module, fields, locals_count, subroutines, lookups, combined):
+    # defines a class scope and then, for every subroutine, its locals, and resolves each visible
+    # name lookups times: with lookup() if combined, otherwise with kind_of/index_of/type_of
+    # (what the compiler needed before lookup() existed)
+    def run():
+        table = module.SymbolTable()
+        for i in range(fields):
+            table.define('int', f'field{i}', 'field')
+        names = [f'field{i}' for i in range(fields)] + [f'v{i}' for i in range(locals_count)]
+        for _ in range(subroutines):
+            table.start_new_subroutine()
+            for i in range(locals_count):
+                table.define('int', f'v{i}', 'local')
+            if combined:
+                lookup = table.lookup
+                for _ in range(lookups):
+                    for name in names:
+                        symbol = lookup(name)
+                        symbol.kind, symbol.index, symbol.type
+            else:
+                kind_of, index_of, type_of = table.kind_of, table.index_of, table.type_of
+                for _ in range(lookups):
+                    for name in names:
+                        kind_of(name), index_of(name), type_of(name)
+    return best_of(run)
+
+def main():
+    usage = "Usage: python3 benchmark.py [--subroutines=N] [--locals=N] [--baseline=path/to/symbol_table.py]"
+    settings = {'subroutines': '100', 'locals': '60', 'baseline': None}
+    for arg in sys.argv[1:]:
+        name, _, value = arg.partition('=')
+        if name[2:] not in settings or not arg.startswith('--'):
+            print(usage)
+            return
+        settings[name[2:]] = value
+    subroutines, locals_count, fields = int(settings['subroutines']), int(settings['locals']), 200
+    source = generate_class(fields=fields, subroutines=subroutines, locals_count=locals_count)
+    output = io.StringIO()
+    compile_time = best_of(lambda: CodeWriter(source, output, 'Big.jack'))
+    print(f"class: {fields} fields, {subroutines} subroutines with {locals_count} locals, "
+          f"{source.count(chr(10))} lines")
+    print(f"{'compile':28} {compile_time * 1000:8.1f} ms")
+    lookups = 20
+    count = subroutines * lookups * (fields + locals_count)
+    results = []
+    if settings['baseline']:
+        baseline = load_module(settings['baseline'])
+        results.append(('baseline, 3 calls', measure_lookups(baseline, fields, locals_count, subroutines, lookups, False)))
+    results.append(('current, 3 calls', measure_lookups(symbol_table, fields, locals_count, subroutines, lookups, False)))
+    results.append(('current, lookup()', measure_lookups(symbol_table, fields, locals_count, subroutines, lookups, True)))
+    for name, elapsed in results:
+        speedup = f"  ({results[0][1] / elapsed:.1f}x)" if len(results) > 1 else ''
+        print(f"{name:28} {elapsed * 1000:8.1f} ms  {count / elapsed / 1e6:6.2f} M lookups/s{speedup}")
+
+if __name__ == "__main__":
+    main()
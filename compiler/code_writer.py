@@ -1,23 +1,72 @@
 from tokenizer import Tokenizer
 from symbol_table import SymbolTable
+from collections import Counter
+from optimizer import (RULES as OPTIMIZATIONS, RIGHT_IDENTITIES, LEFT_IDENTITIES, DOUBLE,
+                       fold, fold_unary, push_constant, power_of_two)
+
+SEGMENTS = {'static': 'static', 'field': 'this', 'local': 'local', 'argument': 'argument'}
+BINARY_OPS = {
+    '+': 'add\n', '-': 'sub\n', '&': 'and\n', '|': 'or\n', '<': 'lt\n', '>': 'gt\n', '=': 'eq\n',
+    '*': 'call Math.multiply 2\n', '/': 'call Math.divide 2\n'
+}
+UNARY_OPS = {'-': 'neg\n', '~': 'not\n'}
+KEYWORD_CONSTANTS = {'true': 'push constant 0\nnot\n', 'false': 'push constant 0\n', 'null': 'push constant 0\n', 'this': 'push pointer 0\n'}
+KEYWORD_VALUES = {'true': -1, 'false': 0, 'null': 0}
+STATEMENTS = {'let', 'if', 'while', 'do', 'return'}
 
 class CodeWriter:
-    def __init__(self, output_file):
-        self.tokenizer = Tokenizer()
+    # Compiles one Jack class in a single pass over the token stream. The VM code is collected
+    # in a list of lines and written out in one go when the class is done.
+    def __init__(self, source, output_file, filename=None, optimizations=()):
+        # output_file is a path, an already open text stream (e.g. io.StringIO) or a list, which
+        # gets one VM command per item; optimizations is a subset of OPTIMIZATIONS (see optimizer.py)
+        unknown = set(optimizations) - set(OPTIMIZATIONS)
+        if unknown:
+            raise ValueError(f"unknown optimizations: {', '.join(sorted(unknown))}")
+        self.optimizations = frozenset(optimizations)
+        self.stats = Counter() # number of rewrites per optimization
+        self.tokenizer = Tokenizer(source, filename)
         self.symbol_table = SymbolTable()
-        self.file = open(output_file, 'w')
+        self.buffer = []
+        self._write = self.buffer.append
+        self.class_name = None
+        self.label_counter = 0 # labels are numbered per class, and prefixed with the class name
         self.compile_class()
+        # the output is only opened once the class compiled without errors
+        self.commands = output_file if isinstance(output_file, list) else None
+        self.file = open(output_file, 'w') if isinstance(output_file, str) else output_file
+        self.flush()
+
+    def flush(self):
+        # the buffer holds fragments of one or more commands, as the optimizations rewrite them
+        if self.commands is not None:
+            self.commands.extend(''.join(self.buffer).splitlines())
+        else:
+            self.file.write(''.join(self.buffer))
+        self.buffer.clear()
+
+    def close(self):
+        self.flush()
+        if self.commands is None:
+            self.file.close()
+
+    def _new_labels(self, *names):
+        self.label_counter += 1
+        return [f'{self.class_name}_{name}{self.label_counter}' for name in names]
 
     def compile_class(self):
         self.tokenizer.advance1('class')
-        class_name = self.tokenizer.advance1('#IDENTIFIER')
+        self.class_name = self.tokenizer.advance1('#IDENTIFIER')
         self.tokenizer.advance1('{')
         while self.tokenizer.get_token() in {'static', 'field'}:
             self.compile_class_var_dec()
         while self.tokenizer.get_token() in {'constructor', 'function', 'method'}:
             self.compile_subroutine_dec()
         self.tokenizer.advance1('}')
-    
+        if self.tokenizer.has_more_tokens():
+            token = self.tokenizer.advance()
+            raise self.tokenizer.error(f"Unexpected token after the end of the class: '{token[1]}'", token)
+
     def compile_class_var_dec(self):
         kind = self.tokenizer.advance2({'static', 'field'})
         datatype = self.tokenizer.advance1('#DATATYPE') # int, char, boolean, or className
@@ -31,19 +80,27 @@ class CodeWriter:
         self.tokenizer.advance1(';')
 
     def compile_subroutine_dec(self):
-        self.symbol_table.start_new_subroutine()
+        self.symbol_table.push_subroutine()
         subroutine_kind = self.tokenizer.advance2({'constructor', 'function', 'method'})
         return_type = self.tokenizer.advance1('#SUBROUTINE_RETURN_TYPE') # void, int, char, boolean, or className
         subroutine_name = self.tokenizer.advance1('#IDENTIFIER')
+        if subroutine_kind == 'method':
+            self.symbol_table.define(self.class_name, 'this', 'argument') # the object is argument 0
         self.tokenizer.advance1('(')
         self.compile_parameter_list()
         self.tokenizer.advance1(')')
         self.tokenizer.advance1('{')
         while self.tokenizer.get_token() == 'var':
             self.compile_var_dec()
-        while self.tokenizer.get_token() in {'let', 'if', 'while', 'do', 'return'}:
-            self.compile_statement()
+        # the number of locals is known once the var declarations are done
+        self._write(f'function {self.class_name}.{subroutine_name} {self.symbol_table.var_count("local")}\n')
+        if subroutine_kind == 'constructor':
+            self._write(f'push constant {self.symbol_table.var_count("field")}\ncall Memory.alloc 1\npop pointer 0\n')
+        elif subroutine_kind == 'method':
+            self._write('push argument 0\npop pointer 0\n')
+        self.compile_statements()
         self.tokenizer.advance1('}')
+        self.symbol_table.pop_subroutine()
 
     def compile_parameter_list(self):
         while self.tokenizer.get_token() != ')':
@@ -63,7 +120,11 @@ class CodeWriter:
             var_name = self.tokenizer.advance1('#IDENTIFIER')
             self.symbol_table.define(datatype, var_name, 'local')
         self.tokenizer.advance1(';')
-    
+
+    def compile_statements(self):
+        while self.tokenizer.get_token() in STATEMENTS:
+            self.compile_statement()
+
     def compile_statement(self):
         token = self.tokenizer.advance2({'let', 'if', 'while', 'do', 'return'})
         if token == 'let':
@@ -76,20 +137,218 @@ class CodeWriter:
             self.compile_do()
         else:
             self.compile_return()
-    
+
+    def _variable(self, name, token=None):
+        # (segment, index) of a variable, with a single symbol table lookup
+        symbol = self.symbol_table.lookup(name)
+        if symbol is None:
+            raise self.tokenizer.error(f"Undefined variable: '{name}'", token)
+        return SEGMENTS[symbol.kind], symbol.index
+
+    def compile_let(self):
+        token = self.tokenizer.peek()
+        var_name = self.tokenizer.advance1('#IDENTIFIER')
+        segment, index = self._variable(var_name, token)
+        if self.tokenizer.get_token() == '[':
+            # arr[i] = value: the target address is computed first, but THAT can only be set
+            # after the value, which may itself use THAT
+            self.tokenizer.advance1('[')
+            self._write(f'push {segment} {index}\n')
+            self.compile_expression()
+            self._write('add\n')
+            self.tokenizer.advance1(']')
+            self.tokenizer.advance1('=')
+            self.compile_expression()
+            self._write('pop temp 0\npop pointer 1\npush temp 0\npop that 0\n')
+        else:
+            self.tokenizer.advance1('=')
+            self.compile_expression()
+            self._write(f'pop {segment} {index}\n')
+        self.tokenizer.advance1(';')
+
+    def compile_if(self):
+        label_false, label_end = self._new_labels('IF_FALSE', 'IF_END')
+        self.tokenizer.advance1('(')
+        self.compile_expression()
+        self.tokenizer.advance1(')')
+        self._write(f'not\nif-goto {label_false}\n')
+        self.tokenizer.advance1('{')
+        self.compile_statements()
+        self.tokenizer.advance1('}')
+        if self.tokenizer.get_token() == 'else':
+            self.tokenizer.advance1('else')
+            self._write(f'goto {label_end}\nlabel {label_false}\n')
+            self.tokenizer.advance1('{')
+            self.compile_statements()
+            self.tokenizer.advance1('}')
+            self._write(f'label {label_end}\n')
+        else:
+            self._write(f'label {label_false}\n')
+
+    def compile_while(self):
+        label_start, label_end = self._new_labels('WHILE_EXP', 'WHILE_END')
+        self._write(f'label {label_start}\n')
+        self.tokenizer.advance1('(')
+        self.compile_expression()
+        self.tokenizer.advance1(')')
+        self._write(f'not\nif-goto {label_end}\n')
+        self.tokenizer.advance1('{')
+        self.compile_statements()
+        self.tokenizer.advance1('}')
+        self._write(f'goto {label_start}\nlabel {label_end}\n')
+
+    def compile_do(self):
+        token = self.tokenizer.peek()
+        name = self.tokenizer.advance1('#IDENTIFIER')
+        self.compile_subroutine_call(name, token)
+        self._write('pop temp 0\n') # the return value is discarded
+        self.tokenizer.advance1(';')
+
+    def compile_return(self):
+        if self.tokenizer.get_token() == ';':
+            self._write('push constant 0\n') # void functions return 0
+        else:
+            self.compile_expression()
+        self._write('return\n')
+        self.tokenizer.advance1(';')
+
+    def compile_subroutine_call(self, name, token):
+        # name has been read already; it is followed by '(' or by '.'
+        num_args = 0
+        if self.tokenizer.get_token() == '.':
+            self.tokenizer.advance1('.')
+            subroutine_name = self.tokenizer.advance1('#IDENTIFIER')
+            symbol = self.symbol_table.lookup(name)
+            if symbol is None: # ClassName.function(...)
+                function_name = f'{name}.{subroutine_name}'
+            else: # var.method(...): the object is the first argument
+                self._write(f'push {SEGMENTS[symbol.kind]} {symbol.index}\n')
+                function_name = f'{symbol.type}.{subroutine_name}'
+                num_args = 1
+        else: # method(...) of this class, called on this
+            self._write('push pointer 0\n')
+            function_name = f'{self.class_name}.{name}'
+            num_args = 1
+        self.tokenizer.advance1('(')
+        num_args += self.compile_expression_list()
+        self.tokenizer.advance1(')')
+        self._write(f'call {function_name} {num_args}\n')
+
+    def compile_expression_list(self):
+        # returns the number of expressions
+        count = 0
+        while self.tokenizer.get_token() != ')':
+            if count:
+                self.tokenizer.advance1(',')
+            self.compile_expression()
+            count += 1
+        return count
+
+    # compile_expression and compile_term return the value of what they compiled if it is a
+    # constant, else None. The code of a constant operand is only pushes, so the optimizations
+    # can drop it from the buffer without losing side effects.
     def compile_expression(self):
-        self.compile_term()
-        while self.tokenizer.get_token() in {'+', '-', '*', '/', '&', '|', '<', '>', '='}:
-            op = self.tokenizer.advance2({'+', '-', '*', '/', '&', '|', '<', '>', '='})
-            self.compile_term()
-            self.write_arithmetic_op(op)
-    
+        buffer = self.buffer
+        start = len(buffer)
+        left = self.compile_term()
+        while self.tokenizer.get_token() in BINARY_OPS:
+            op = self.tokenizer.advance2(BINARY_OPS)
+            middle = len(buffer)
+            right = self.compile_term()
+            if self.optimizations:
+                left = self._optimize_binary(op, left, right, start, middle)
+            else:
+                self._write(BINARY_OPS[op])
+                left = None
+        return left
+
+    def _optimize_binary(self, op, left, right, start, middle):
+        # the code of the left operand is buffer[start:middle], the one of the right operand
+        # buffer[middle:]; either writes the operator or a rewrite of the whole operation
+        buffer, optimizations = self.buffer, self.optimizations
+        if 'fold' in optimizations and left is not None and right is not None:
+            value = fold(op, left, right)
+            if value is not None:
+                del buffer[start:]
+                self._write(push_constant(value))
+                self.stats['fold'] += 1
+                return value
+        if 'identities' in optimizations:
+            if right is not None and RIGHT_IDENTITIES.get(op) == right:
+                del buffer[middle:]
+                self.stats['identities'] += 1
+                return left
+            if left is not None and LEFT_IDENTITIES.get(op) == left:
+                del buffer[start:middle]
+                self.stats['identities'] += 1
+                return right
+            if left == 0 and op == '-':
+                del buffer[start:middle]
+                self._write('neg\n')
+                self.stats['identities'] += 1
+                return None
+        if 'strength' in optimizations and op == '*':
+            shift = power_of_two(right)
+            if shift is not None:
+                del buffer[middle:]
+            else:
+                shift = power_of_two(left)
+                if shift is not None:
+                    del buffer[start:middle]
+            if shift is not None:
+                self._write(DOUBLE * shift)
+                self.stats['strength'] += 1
+                return None
+        self._write(BINARY_OPS[op])
+        return None
+
     def compile_term(self):
-        token = self.tokenizer.get_token()
-        token_type = self.tokenizer.token_type(token)
+        token = self.tokenizer.advance()
+        token_type, value = token[0], token[1]
         if token_type == 'INT_CONST':
-            self.file.write(f'push constant {token}')
+            self._write(f'push constant {value}\n')
+            return int(value)
+        elif token_type == 'STRING_CONST':
+            self._write(f'push constant {len(value)}\ncall String.new 1\n')
+            for char in value:
+                self._write(f'push constant {ord(char)}\ncall String.appendChar 2\n')
+        elif token_type == 'KEYWORD' and value in KEYWORD_CONSTANTS:
+            self._write(KEYWORD_CONSTANTS[value])
+            return KEYWORD_VALUES.get(value)
         elif token_type == 'IDENTIFIER':
-            var_kind = self.symbol_table.kind_of(token)
-            var_index = self.symbol_table.index_of(token)
-            self.file.write(f'push {var_kind} {var_index}')
\ No newline at end of file
+            next_token = self.tokenizer.get_token()
+            if next_token == '[':
+                segment, index = self._variable(value, token)
+                self.tokenizer.advance1('[')
+                self._write(f'push {segment} {index}\n')
+                self.compile_expression()
+                self.tokenizer.advance1(']')
+                self._write('add\npop pointer 1\npush that 0\n')
+            elif next_token in ('(', '.'):
+                self.compile_subroutine_call(value, token)
+            else:
+                segment, index = self._variable(value, token)
+                self._write(f'push {segment} {index}\n')
+        elif token_type == 'SYMBOL' and value == '(':
+            constant = self.compile_expression()
+            self.tokenizer.advance1(')')
+            return constant
+        elif token_type == 'SYMBOL' and value in UNARY_OPS:
+            start = len(self.buffer)
+            constant = self.compile_term()
+            op = UNARY_OPS[value]
+            if 'fold' in self.optimizations and constant is not None:
+                del self.buffer[start:]
+                constant = fold_unary(value, constant)
+                self._write(push_constant(constant))
+                self.stats['fold'] += 1
+                return constant
+            if 'identities' in self.optimizations and len(self.buffer) > start and self.buffer[-1] == op:
+                # the operand ends with the same unary operator: ~~x and --x are x
+                self.buffer.pop()
+                self.stats['identities'] += 1
+                return None
+            self._write(op)
+        else:
+            raise self.tokenizer.error(f"Unexpected token: '{value}'", token)
+        return None
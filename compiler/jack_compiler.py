@@ -0,0 +1,75 @@
+import io
+import os, sys
+from code_writer import CodeWriter, OPTIMIZATIONS
+
+def read_file(filename):
+    with open(filename, 'r') as file:
+        return file.read()
+
+def compile_file(abs_path, optimizations=()):
+    # compiles Foo.jack into Foo.vm next to it; returns the output file name
+    output_filename = os.path.splitext(abs_path)[0] + '.vm'
+    code_writer = CodeWriter(read_file(abs_path), output_filename, os.path.basename(abs_path), optimizations)
+    code_writer.close()
+    return output_filename
+
+def count_commands(abs_path, optimizations=()):
+    # number of VM commands Foo.jack compiles to, and the number of rewrites per optimization
+    output = io.StringIO()
+    code_writer = CodeWriter(read_file(abs_path), output, os.path.basename(abs_path), optimizations)
+    return output.getvalue().count('\n'), code_writer.stats
+
+def jack_files(abs_path):
+    return sorted(os.path.join(abs_path, file) for file in os.listdir(abs_path) if file.endswith('.jack'))
+
+def handle_dir(abs_path, optimizations=()):
+    return [compile_file(file, optimizations) for file in jack_files(abs_path)]
+
+def report(files, optimizations):
+    # VM command counts without and with the optimizations, per file and in total
+    total_before = total_after = 0
+    for file in files:
+        before, _ = count_commands(file)
+        after, stats = count_commands(file, optimizations)
+        total_before, total_after = total_before + before, total_after + after
+        rewrites = ', '.join(f'{rule} {stats[rule]}' for rule in optimizations)
+        print(f"{os.path.basename(file)}: {before} -> {after} VM commands ({rewrites})")
+    if len(files) > 1:
+        print(f"total: {total_before} -> {total_after} VM commands")
+
+def main():
+    args = sys.argv[1:]
+    flags = [arg for arg in args if arg.startswith('--')]
+    args = [arg for arg in args if not arg.startswith('--')]
+    optimizations = ()
+    for flag in flags:
+        name, _, value = flag.partition('=')
+        if name == '--optimize':
+            optimizations = tuple(value.split(',')) if value else OPTIMIZATIONS
+        else:
+            optimizations = None
+            break
+    if len(args) != 1 or optimizations is None or not set(optimizations) <= set(OPTIMIZATIONS):
+        print("Usage:\npython3 jack_compiler.py [--optimize[=" + ','.join(OPTIMIZATIONS) + "]] path/to/file.jack")
+        print("OR\npython3 jack_compiler.py [--optimize[=...]] path/to/directory")
+        return
+    abs_path = os.path.abspath(args[0])
+    if not os.path.exists(abs_path):
+        print(f"no file or folder found: {args[0]}")
+        return
+    try:
+        if os.path.isdir(abs_path):
+            handle_dir(abs_path, optimizations)
+            files = jack_files(abs_path)
+        else:
+            compile_file(abs_path, optimizations)
+            files = [abs_path]
+        if optimizations:
+            report(files, optimizations)
+    except SyntaxError as e:
+        print(e)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
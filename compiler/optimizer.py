@@ -0,0 +1,57 @@
+# Expression-level rewrites, applied by the CodeWriter while an expression is compiled:
+#   fold:       operators and unary operators with constant operands are computed at compile time
+#   strength:   x * 2^k becomes k doublings instead of a call to Math.multiply
+#   identities: x + 0, x - 0, x * 1, x / 1, x | 0, x & true (and the mirrored forms) become x,
+#               0 - x becomes -x, and ~~x and --x become x
+# Jack integers are 16-bit two's complement, so every folded value wraps around like the Hack ALU.
+RULES = ('fold', 'strength', 'identities')
+
+RIGHT_IDENTITIES = {'+': 0, '-': 0, '*': 1, '/': 1, '|': 0, '&': -1}
+LEFT_IDENTITIES = {'+': 0, '*': 1, '|': 0, '&': -1}
+DOUBLE = 'pop temp 1\npush temp 1\npush temp 1\nadd\n'
+
+def wrap(value):
+    # value as a signed 16-bit integer
+    return (value + 0x8000) % 0x10000 - 0x8000
+
+def fold(op, left, right):
+    # the value of left op right, None if it cannot be computed at compile time
+    if op == '+':
+        return wrap(left + right)
+    if op == '-':
+        return wrap(left - right)
+    if op == '*':
+        return wrap(left * right)
+    if op == '/':
+        if right == 0:
+            return None # left to fail at run time, like the unoptimized code
+        quotient = abs(left) // abs(right) # Math.divide rounds towards zero
+        return wrap(quotient if (left < 0) == (right < 0) else -quotient)
+    if op == '&':
+        return left & right
+    if op == '|':
+        return left | right
+    if op == '<':
+        return -1 if left < right else 0
+    if op == '>':
+        return -1 if left > right else 0
+    if op == '=':
+        return -1 if left == right else 0
+    return None
+
+def fold_unary(op, value):
+    return wrap(-value) if op == '-' else ~value
+
+def push_constant(value):
+    # VM code pushing a signed 16-bit value, as a single string
+    if value >= 0:
+        return f'push constant {value}\n'
+    if value == -0x8000:
+        return 'push constant 32767\nneg\npush constant 1\nsub\n'
+    return f'push constant {-value}\nneg\n'
+
+def power_of_two(value):
+    # k if value is 2^k with k >= 1, else None
+    if value is not None and value > 1 and value & (value - 1) == 0:
+        return value.bit_length() - 1
+    return None
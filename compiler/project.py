@@ -0,0 +1,121 @@
+import hashlib
+import json
+import modulefinder
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from jack_compiler import compile_file, jack_files
+
+COMPILER_DIR = os.path.dirname(os.path.abspath(__file__))
+MANIFEST_NAME = '.jackcache.json'
+
+def compiler_modules():
+    # jack_compiler.py and every module of this directory it imports, directly or not (found
+    # from the import statements, so a module added to the compiler is picked up on its own)
+    finder = modulefinder.ModuleFinder(path=[COMPILER_DIR])
+    finder.run_script(os.path.join(COMPILER_DIR, 'jack_compiler.py'))
+    return sorted(os.path.abspath(module.__file__) for module in finder.modules.values() if module.__file__)
+
+def compiler_version():
+    # cached .vm files are only valid for the exact compiler sources that produced them
+    digest = hashlib.sha256()
+    for module in compiler_modules():
+        with open(module, 'rb') as file:
+            digest.update(os.path.basename(module).encode() + b'\0' + file.read())
+    return digest.hexdigest()[:16]
+
+def source_key(jack_filename, version):
+    with open(jack_filename, 'rb') as file:
+        return hashlib.sha256(version.encode() + b'\0' + file.read()).hexdigest()
+
+def load_manifest(manifest_path):
+    # {jack file name: key of the source the .vm next to it was compiled from}
+    try:
+        with open(manifest_path, 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+def save_manifest(manifest_path, manifest):
+    temp_path = f'{manifest_path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w') as file:
+        json.dump(manifest, file, indent=0, sort_keys=True)
+    os.replace(temp_path, manifest_path)
+
+def compile_job(jack_filename):
+    # runs in a worker process; errors are reported back instead of raised so the build keeps going
+    start = time.perf_counter()
+    try:
+        compile_file(jack_filename)
+        error = None
+    except SyntaxError as e:
+        error = str(e) # already starts with the file name and position
+    except Exception as e:
+        error = f"{os.path.basename(jack_filename)}: {type(e).__name__}: {e}"
+    return jack_filename, time.perf_counter() - start, error
+
+def build_project(abs_path, workers=None, force=False):
+    # compiles the .jack files of a directory whose source or compiler changed since the last
+    # build; returns {'compiled': [(file, seconds)], 'cached': [file], 'failed': [(file, error)]}
+    manifest_path = os.path.join(abs_path, MANIFEST_NAME)
+    manifest = {} if force else load_manifest(manifest_path)
+    version = compiler_version()
+    jobs, keys = [], {}
+    results = {'compiled': [], 'cached': [], 'failed': []}
+    for file in jack_files(abs_path):
+        name = os.path.basename(file)
+        keys[name] = source_key(file, version)
+        vm_filename = os.path.splitext(file)[0] + '.vm'
+        if manifest.get(name) == keys[name] and os.path.exists(vm_filename):
+            results['cached'].append(file)
+        else:
+            jobs.append(file)
+    if len(jobs) > 1 and workers != 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            outcomes = list(executor.map(compile_job, jobs))
+    else: # a worker pool costs more to start than compiling a single class
+        outcomes = [compile_job(file) for file in jobs]
+    for file, elapsed, error in outcomes:
+        name = os.path.basename(file)
+        if error is None:
+            results['compiled'].append((file, elapsed))
+            manifest[name] = keys[name]
+        else:
+            results['failed'].append((file, error))
+            manifest.pop(name, None)
+    # classes that were deleted since the last build are dropped from the manifest
+    manifest = {name: key for name, key in manifest.items() if name in keys}
+    if jobs or force:
+        save_manifest(manifest_path, manifest)
+    return results
+
+def main():
+    usage = "Usage: python3 project.py [--force] [--jobs=N] path/to/directory"
+    args = sys.argv[1:]
+    force = '--force' in args
+    if force:
+        args.remove('--force')
+    workers = None
+    for arg in list(args):
+        if arg.startswith('--jobs='):
+            workers = int(arg.split('=', 1)[1])
+            args.remove(arg)
+    if len(args) != 1 or not os.path.isdir(args[0]):
+        print(usage)
+        return
+    start = time.perf_counter()
+    results = build_project(os.path.abspath(args[0]), workers, force)
+    elapsed = time.perf_counter() - start
+    for file, seconds in results['compiled']:
+        print(f"{seconds * 1000:9.1f} ms  {os.path.basename(file)}")
+    for file, error in results['failed']:
+        print(f"{'FAILED':>12}  {error}")
+    print(f"{len(results['compiled'])} compiled, {len(results['cached'])} up to date, "
+          f"{len(results['failed'])} failed in {elapsed * 1000:.1f} ms")
+    if results['failed']:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,49 +1,80 @@
+import sys
+
+CLASS_KINDS = ('static', 'field')
+SUBROUTINE_KINDS = ('local', 'argument')
+
+
+class Symbol:
+    __slots__ = ('name', 'type', 'kind', 'index')
+
+    def __init__(self, name, datatype, kind, index):
+        self.name = name
+        self.type = datatype
+        self.kind = kind
+        self.index = index
+
+    def __repr__(self):
+        return f'Symbol({self.name!r}, {self.type!r}, {self.kind!r}, {self.index})'
+
+
 class SymbolTable:
+    # All visible names live in one dict, so a lookup is a single probe. A subroutine's names are
+    # added to it on top of the class names; the entries they shadow are kept on a stack and put
+    # back when the subroutine scope is popped.
 
     def __init__(self):
-        self.class_scope = {'static': 0, 'field': 0}
-        self.indexes = {
-            'static': 0,
-            'field': 0,
-            'local': 0,
-            'argument': 0
-        }
+        self.symbols = {}
+        self.counts = {'static': 0, 'field': 0, 'local': 0, 'argument': 0}
+        self.shadowed = None # (name, previous symbol or None) for each subroutine name
+
+    def push_subroutine(self):
+        self.pop_subroutine()
+        self.shadowed = []
+        self.counts['local'] = 0
+        self.counts['argument'] = 0
+
+    def pop_subroutine(self):
+        if self.shadowed is None:
+            return
+        symbols = self.symbols
+        for name, previous in reversed(self.shadowed):
+            if previous is None:
+                del symbols[name]
+            else:
+                symbols[name] = previous
+        self.shadowed = None
 
     def start_new_subroutine(self):
-        self.subroutine_scope = {'local': 0, 'argument': 0}
-        self.indexes['local'] = 0
-        self.indexes['argument'] = 0
+        self.push_subroutine()
 
     def define(self, datatype, name, kind):
-        if kind in ['static', 'field']:
-            self.class_scope[name] = (datatype, kind, self.indexes[kind])
-        elif kind in ['local', 'argument']:
-            self.subroutine_scope[name] = (datatype, kind, self.indexes[kind])
-        self.indexes[kind] += 1
-    
+        name = sys.intern(name)
+        if kind in SUBROUTINE_KINDS:
+            if self.shadowed is None:
+                raise ValueError(f"'{name}' defined as {kind} outside of a subroutine")
+            self.shadowed.append((name, self.symbols.get(name)))
+        elif kind not in CLASS_KINDS:
+            raise ValueError(f"unknown kind of variable: '{kind}'")
+        symbol = Symbol(name, datatype, kind, self.counts[kind])
+        self.symbols[name] = symbol
+        self.counts[kind] += 1
+        return symbol
+
+    def lookup(self, name):
+        # the Symbol a name refers to in the current scope, None if it is not defined
+        return self.symbols.get(name)
+
     def var_count(self, kind):
-        return self.indexes[kind]
-    
+        return self.counts[kind]
+
     def type_of(self, name):
-        if name in self.subroutine_scope:
-            return self.subroutine_scope[name][0]
-        elif name in self.class_scope:
-            return self.class_scope[name][0]
-        else:
-            return None
+        symbol = self.symbols.get(name)
+        return symbol.type if symbol is not None else None
 
     def kind_of(self, name):
-        if name in self.subroutine_scope:
-            return self.subroutine_scope[name][1]
-        elif name in self.class_scope:
-            return self.class_scope[name][1]
-        else:
-            return None
+        symbol = self.symbols.get(name)
+        return symbol.kind if symbol is not None else None
 
     def index_of(self, name):
-        if name in self.subroutine_scope:
-            return self.subroutine_scope[name][2]
-        elif name in self.class_scope:
-            return self.class_scope[name][2]
-        else:
-            return None
\ No newline at end of file
+        symbol = self.symbols.get(name)
+        return symbol.index if symbol is not None else None
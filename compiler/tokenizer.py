@@ -1,91 +1,133 @@
 import re
+from collections import deque
+
+
+KEYWORDS = ["class", "constructor", "function", "method", "field", "static", "var",
+                "int", "char", "boolean", "void", "true", "false", "null", "this", "let",
+                "do", "if", "else", "while", "return"]
+SYMBOLS = {"{", "}", "(", ")", "[", "]", ".", ",", ";", "+", "-", "*", "/", "&", "|", "<", ">", "=", "~"}
+MAX_INT = 32767
+MAX_LOOKAHEAD = 2 # Jack needs one token after the current one (e.g. an identifier followed by '[', '(' or '.')
+
+# One match per token, classified by the name of the group that matched. Whitespace and comments
+# in front of a token are skipped as part of the same match; a string constant is always matched
+# as a whole, so a "//" inside it is not a comment.
+TOKEN_PATTERN = re.compile(r'''
+    (?:\s+|//[^\n]*|/\*.*?\*/)*
+    (?:
+        (?P<KEYWORD>(?:''' + '|'.join(KEYWORDS) + r''')\b)
+      | (?P<IDENTIFIER>[A-Za-z_]\w*)
+      | (?P<SYMBOL>[{}()\[\].,;+\-*&|<>=~]|/(?!\*))
+      | (?P<INT_CONST>\d+)
+      | "(?P<STRING_CONST>[^"\n]*)"
+      | (?P<ERROR>/\*|"|.)
+      | (?P<END>\Z)
+    )
+''', re.VERBOSE | re.DOTALL)
+ERROR_MESSAGES = {'/*': "Unterminated comment", '"': "Unterminated string constant"}
+
+
+def position(string, offset):
+    # (line, column) of a character offset, both starting at 1; only needed for error messages,
+    # so tokens carry just the offset
+    line = string.count('\n', 0, offset) + 1
+    return line, offset - string.rfind('\n', 0, offset)
+
+
+def syntax_error(message, string, offset, filename=None):
+    # "Main.jack:12:5: Unexpected token: ')'"
+    line, column = position(string, offset)
+    return SyntaxError(f"{filename or '<input>'}:{line}:{column}: {message}")
+
+
+def scan(string, filename=None):
+    # Yields one (type, value, offset) tuple per token: type is 'KEYWORD', 'SYMBOL', 'INT_CONST',
+    # 'STRING_CONST' or 'IDENTIFIER', string constants are given without their quotes, and
+    # offset is where the token starts in string.
+    for match in TOKEN_PATTERN.finditer(string):
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'END':
+            return
+        if kind == 'ERROR':
+            message = ERROR_MESSAGES.get(value, f"Invalid character: '{value}'")
+            raise syntax_error(message, string, match.start(kind), filename)
+        if kind == 'INT_CONST' and len(value) > 4 and int(value) > MAX_INT:
+            raise syntax_error(f"Integer constant too large: {value}", string, match.start(kind), filename)
+        yield kind, value, match.start(kind)
 
 
 class Tokenizer:
+    # The tokens are produced lazily by scan(); only the next MAX_LOOKAHEAD tokens are buffered.
+
+    KEYWORDS = set(KEYWORDS)
+    SYMBOLS = SYMBOLS
+
+    def __init__(self, string, filename=None):
+        self.string = string
+        self.filename = filename
+        self.tokens = scan(string, filename)
+        self.lookahead = deque()
+
+    def peek(self, offset=0):
+        # the token offset places after the next one (without consuming anything), None at the end
+        lookahead = self.lookahead
+        if len(lookahead) > offset:
+            return lookahead[offset]
+        if offset >= MAX_LOOKAHEAD:
+            raise ValueError(f"lookahead is limited to {MAX_LOOKAHEAD} tokens")
+        while len(lookahead) <= offset:
+            token = next(self.tokens, None)
+            if token is None:
+                return None
+            lookahead.append(token)
+        return lookahead[offset]
+
+    def has_more_tokens(self):
+        return self.peek() is not None
 
-    KEYWORDS = {"class", "constructor", "function", "method", "field", "static", "var",
-                    "int", "char", "boolean", "void", "true", "false", "null", "this", "let",
-                    "do", "if", "else", "while", "return"}
-    SYMBOLS = {"{", "}", "(", ")", "[", "]", ".", ",", ";", "+", "-", "*", "/", "&", "|", "<", ">", "=", "~"}
-
-    def __init__(self, string):
-        self.current_token_index = -1
-        self.tokens = self.tokenize(string)
-
-    def tokenize(self, string):
-        string = re.sub(r'//.*\n', '', string) # remove inline comments
-        string = re.sub(r'/\*.*?\*/', '', string, flags=re.DOTALL) # remove multiline comments
-        pattern = r'(".*?"|\b\w+\b|[{}()\[\].,;+\-*/&|<>=~])' # match with either a string constant, a word or a punctuation/operator
-        tokens = re.findall(pattern, string)
-        return tokens
-        
-    def _has_more_tokens(self):
-        return self.current_token_index < len(self.tokens)
-    
     def get_token(self):
-        if self._has_more_tokens():
-            return self.tokens[self.current_token_index]
-        raise IndexError("No more tokens available")
-    
-    def _is_valid_var_name(self, variable):
-        if variable in Tokenizer.KEYWORDS:
-            return False
-        if not (variable[0].isalpha() or variable[0] == '_'):
-            return False
-        if not all(c.isalnum() or c == '_' for c in variable):
-            return False
-        return True
-
-    def _is_valid_datatype(self, datatype):
-        if datatype in ['int', 'char', 'boolean']:
-            return True
-        if self._is_valid_var_name(datatype):
-            return True
-        return False
-    
-    def _is_valid_return_type(self, return_type):
-        if return_type == 'void':
-            return True
-        if self._is_valid_datatype(return_type):
-            return True
-        return False
+        # value of the next token, None at the end of the input
+        token = self.peek()
+        return token[1] if token is not None else None
+
+    def token_type(self):
+        # type of the next token, None at the end of the input
+        token = self.peek()
+        return token[0] if token is not None else None
+
+    def error(self, message, token=None):
+        # a SyntaxError pointing at token (or at the end of the input)
+        return syntax_error(message, self.string, token[2] if token else len(self.string), self.filename)
+
+    def advance(self):
+        # consumes and returns the next (type, value, offset) token
+        if self.lookahead or self.peek() is not None:
+            return self.lookahead.popleft()
+        raise self.error("Unexpected end of input")
 
     def advance1(self, expected_token):
-        self.current_token_index += 1
-        token = self.get_token()
+        token = self.advance()
+        token_type, value = token[0], token[1]
         if expected_token == "#IDENTIFIER":
-            if self._is_valid_var_name(token):
-                return token
-            raise SyntaxError(f"Invalid variable name: '{token}'")
+            if token_type == 'IDENTIFIER':
+                return value
+            raise self.error(f"Invalid variable name: '{value}'", token)
         if expected_token == "#DATATYPE":
             # TODO: make sure that datatype is from set of classnames
-            if self._is_valid_datatype(token):
-                return token
-            raise SyntaxError(f"Invalid data type: '{token}'")
+            if token_type == 'IDENTIFIER' or value in ('int', 'char', 'boolean'):
+                return value
+            raise self.error(f"Invalid data type: '{value}'", token)
         if expected_token == '#SUBROUTINE_RETURN_TYPE':
-            if self._is_valid_return_type(token):
-                return token
-            raise SyntaxError(f"Invalid return type: '{token}")
-        if token != expected_token:
-            raise SyntaxError(f"Unexpected token: '{token}'")
-        return token
-    
+            if token_type == 'IDENTIFIER' or value in ('void', 'int', 'char', 'boolean'):
+                return value
+            raise self.error(f"Invalid return type: '{value}'", token)
+        if value != expected_token or token_type == 'STRING_CONST':
+            raise self.error(f"Unexpected token: '{value}'", token)
+        return value
+
     def advance2(self, expected_tokens_list):
-        self.current_token_index += 1
-        token = self.get_token()
-        for expected_token in expected_tokens_list:
-            if token == expected_token:
-                return token
-        raise SyntaxError(f"Unexpected token: '{token}'")
-
-    def token_type(self, token):
-        if token in self.KEYWORDS:
-            return 'KEYWORD'
-        elif token in self.SYMBOLS:
-            return 'SYMBOL'
-        elif token.isdigit():
-            return 'INT_CONST'
-        elif token.startswith('"'):
-            return 'STRING_CONST'
-        else:
-            return 'IDENTIFIER'
\ No newline at end of file
+        token = self.advance()
+        if token[1] in expected_tokens_list and token[0] != 'STRING_CONST':
+            return token[1]
+        raise self.error(f"Unexpected token: '{token[1]}'", token)
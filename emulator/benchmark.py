@@ -0,0 +1,32 @@
+import os
+import sys
+import time
+
+from test_runner import DEFAULT_TESTS, create_cpu, translate_dir
+
+def fibonacci_program(n):
+    # FibonacciElement with Sys.init computing fibonacci(n) instead of fibonacci(4)
+    asm_text = translate_dir(os.path.join(DEFAULT_TESTS, 'FunctionCalls', 'FibonacciElement'))
+    return asm_text.replace('// push constant 4\n@4\n', f'// push constant {n}\n@{n}\n', 1)
+
+def measure(asm_text, cycles, jit):
+    cpu = create_cpu(asm_text, jit)
+    start = time.perf_counter()
+    executed = cpu.run(cycles)
+    return cpu, executed, time.perf_counter() - start
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    cycles = int(sys.argv[2]) if len(sys.argv) > 2 else 3000000
+    asm_text = fibonacci_program(n)
+    interpreter, executed, interpreter_time = measure(asm_text, cycles, jit=False)
+    jit, jit_executed, jit_time = measure(asm_text, cycles, jit=True)
+    assert (executed, interpreter.pc, interpreter.ram) == (jit_executed, jit.pc, jit.ram), "JIT and interpreter disagree"
+    print(f"fibonacci({n}): {executed} instructions, RAM[261] = {interpreter.ram[261]}")
+    print(f"interpreter: {interpreter_time:7.3f} s  {executed / interpreter_time / 1e6:6.2f} M instr/s")
+    print(f"block JIT:   {jit_time:7.3f} s  {executed / jit_time / 1e6:6.2f} M instr/s  ({interpreter_time / jit_time:.1f}x)")
+    print("             {blocks_compiled} blocks compiled in {compile_time:.4f} s, {block_hits} block hits, "
+          "{interpreted_cycles} cycles interpreted".format(**jit.stats()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import os
+import sys
+
+from jit import UNCONDITIONAL_JUMP
+from test_runner import DEFAULT_TESTS, find_tests, run_test, vm_translator
+
+def halting_loops(rom):
+    # addresses X of the usual halting loop (X) @X 0;JMP
+    return [address for address in range(len(rom) - 1)
+            if rom[address] == address and rom[address + 1] == UNCONDITIONAL_JUMP]
+
+def cycles_to_halt(cpu):
+    # the .tst scripts tick a fixed number of times, so cpu.cycles also counts the time spent
+    # spinning in the halting loop; this is the number of instructions the program itself needed
+    spinning = sum(cpu.counts[address] + cpu.counts[address + 1] for address in halting_loops(cpu.rom))
+    return cpu.cycles - spinning
+
+def measure(tst_filename, **options):
+    # (passed, ROM size, cycles to halt) of a test translated with options
+    passed, _, _, cpu = run_test(tst_filename, profile=True, **options)
+    return passed, len(cpu.rom), cycles_to_halt(cpu)
+
+def main():
+    usage = "Usage: python3 cycles.py [--compact] [--peephole] [--cache-top] [path/to/test.tst path/to/test/directory/ ...]"
+    args = sys.argv[1:]
+    options = {}
+    for arg in list(args):
+        if arg == '--compact':
+            options['compact'] = True
+        elif arg == '--peephole':
+            options['peephole'] = vm_translator.PEEPHOLE_RULES
+        elif arg == '--cache-top':
+            options['cache_top'] = True
+        elif arg.startswith('--'):
+            print(usage)
+            return
+        else:
+            continue
+        args.remove(arg)
+    if not options:
+        options['cache_top'] = True
+    totals = [0, 0]
+    failed = 0
+    flags = ' '.join(f'--{name.replace("_", "-")}' for name in options)
+    print(f"{'':24} {'default':>15}   {flags:>15}")
+    print(f"{'test':24} {'ROM':>6} {'cycles':>8}   {'ROM':>6} {'cycles':>8}")
+    for tst_filename in find_tests(args or [DEFAULT_TESTS]):
+        passed, size, cycles = measure(tst_filename)
+        new_passed, new_size, new_cycles = measure(tst_filename, **options)
+        failed += not (passed and new_passed)
+        totals[0] += cycles
+        totals[1] += new_cycles
+        print(f"{os.path.basename(tst_filename):24} {size:6} {cycles:8}   {new_size:6} {new_cycles:8}  "
+              f"({new_cycles / cycles - 1:+.1%}){'' if new_passed else '  FAIL'}")
+    if totals[0]:
+        print(f"{'total':24} {'':6} {totals[0]:8}   {'':6} {totals[1]:8}  ({totals[1] / totals[0] - 1:+.1%})")
+    if failed:
+        print(f"{failed} failed")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
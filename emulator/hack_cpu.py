@@ -0,0 +1,155 @@
+import sys
+import time
+from array import array
+
+RAM_SIZE = 32768 # 16K data memory + 8K screen + keyboard, rounded up to the 15-bit address space
+ROM_SIZE = 32768
+ADDRESS_MASK = 0x7FFF
+
+def _wrap(expression):
+    # results of + and - have to be brought back into the signed 16-bit range
+    return f'((({expression}) + 32768) & 0xFFFF) - 32768'
+
+# comp field (a-bit included) -> expression over a, d and m
+COMP_EXPRESSIONS = {
+    0b0101010: '0', 0b0111111: '1', 0b0111010: '-1',
+    0b0001100: 'd', 0b0110000: 'a', 0b1110000: 'm',
+    0b0001101: '~d', 0b0110001: '~a', 0b1110001: '~m',
+    0b0001111: _wrap('-d'), 0b0110011: _wrap('-a'), 0b1110011: _wrap('-m'),
+    0b0011111: _wrap('d + 1'), 0b0110111: _wrap('a + 1'), 0b1110111: _wrap('m + 1'),
+    0b0001110: _wrap('d - 1'), 0b0110010: _wrap('a - 1'), 0b1110010: _wrap('m - 1'),
+    0b0000010: _wrap('d + a'), 0b1000010: _wrap('d + m'),
+    0b0010011: _wrap('d - a'), 0b1010011: _wrap('d - m'),
+    0b0000111: _wrap('a - d'), 0b1000111: _wrap('m - d'),
+    0b0000000: 'd & a', 0b1000000: 'd & m',
+    0b0010101: 'd | a', 0b1010101: 'd | m'
+}
+
+def alu(comp, a, d, m):
+    # the Hack ALU, bit by bit; only used for comp fields that are not in COMP_EXPRESSIONS
+    y = m if comp & 0b1000000 else a
+    x = d
+    if comp & 0b100000: x = 0
+    if comp & 0b010000: x = ~x
+    if comp & 0b001000: y = 0
+    if comp & 0b000100: y = ~y
+    out = x + y if comp & 0b000010 else x & y
+    if comp & 0b000001: out = ~out
+    return ((out + 32768) & 0xFFFF) - 32768
+
+def _build_comp_functions():
+    functions = []
+    for comp in range(128):
+        if comp in COMP_EXPRESSIONS:
+            functions.append(eval(f'lambda a, d, m: {COMP_EXPRESSIONS[comp]}'))
+        else:
+            functions.append(lambda a, d, m, comp=comp: alu(comp, a, d, m))
+    return functions
+
+COMP_FUNCTIONS = _build_comp_functions()
+
+def decode(word):
+    # (value, comp_function, reads_m, dest, jump); comp_function is None for A-instructions
+    if not word & 0x8000:
+        return (word, None, False, 0, 0)
+    comp = (word >> 6) & 0x7F
+    return (0, COMP_FUNCTIONS[comp], bool(comp & 0b1000000), (word >> 3) & 0b111, word & 0b111)
+
+def load_hack(filename):
+    # ROM words from a .hack text file, or from a packed little-endian .bin image
+    if filename.endswith('.bin'):
+        words = array('H')
+        with open(filename, 'rb') as file:
+            words.frombytes(file.read())
+        if sys.byteorder == 'big':
+            words.byteswap()
+        return list(words)
+    with open(filename, 'r') as file:
+        return [int(line, 2) for line in file if line.strip()]
+
+class HackCPU:
+    def __init__(self, rom, profile=False):
+        if len(rom) > ROM_SIZE:
+            raise ValueError(f"program does not fit in ROM: {len(rom)} instructions")
+        self.rom = array('H', rom)
+        self.ram = array('h', bytes(2 * RAM_SIZE))
+        self.program = [decode(word) for word in self.rom] # every ROM word is decoded exactly once
+        self.a = 0
+        self.d = 0
+        self.pc = 0
+        self.cycles = 0
+        self.elapsed = 0.0
+        # with profile=True, the number of times each ROM address was executed
+        self.counts = array('l', bytes(array('l').itemsize * len(self.rom))) if profile else None
+
+    def reset(self):
+        self.a = self.d = self.pc = 0
+
+    def run(self, max_cycles):
+        # executes up to max_cycles instructions and returns how many were executed; stops
+        # early if the program counter runs past the end of the program
+        start = time.perf_counter()
+        cycles = self._execute(max_cycles) if self.counts is None else self._execute_profiled(max_cycles)
+        self.elapsed += time.perf_counter() - start
+        self.cycles += cycles
+        return cycles
+
+    def _execute(self, max_cycles):
+        ram, program = self.ram, self.program
+        a, d, pc = self.a, self.d, self.pc
+        size = len(program)
+        cycles = 0
+        while cycles < max_cycles and pc < size:
+            value, comp, reads_m, dest, jump = program[pc]
+            cycles += 1
+            if comp is None:
+                a = value
+                pc += 1
+                continue
+            out = comp(a, d, ram[a & ADDRESS_MASK] if reads_m else 0)
+            target = a
+            if dest:
+                if dest & 0b001: ram[a & ADDRESS_MASK] = out
+                if dest & 0b100: a = out
+                if dest & 0b010: d = out
+            if jump and ((jump & 0b100 and out < 0) or (jump & 0b010 and out == 0) or (jump & 0b001 and out > 0)):
+                pc = target & ADDRESS_MASK
+            else:
+                pc += 1
+        self.a, self.d, self.pc = a, d, pc
+        return cycles
+
+    def _execute_profiled(self, max_cycles):
+        # _execute, counting the executions of every address; a separate copy, so that the
+        # loop without profiling does not pay for the check
+        ram, program, counts = self.ram, self.program, self.counts
+        a, d, pc = self.a, self.d, self.pc
+        size = len(program)
+        cycles = 0
+        while cycles < max_cycles and pc < size:
+            value, comp, reads_m, dest, jump = program[pc]
+            counts[pc] += 1
+            cycles += 1
+            if comp is None:
+                a = value
+                pc += 1
+                continue
+            out = comp(a, d, ram[a & ADDRESS_MASK] if reads_m else 0)
+            target = a
+            if dest:
+                if dest & 0b001: ram[a & ADDRESS_MASK] = out
+                if dest & 0b100: a = out
+                if dest & 0b010: d = out
+            if jump and ((jump & 0b100 and out < 0) or (jump & 0b010 and out == 0) or (jump & 0b001 and out > 0)):
+                pc = target & ADDRESS_MASK
+            else:
+                pc += 1
+        self.a, self.d, self.pc = a, d, pc
+        return cycles
+
+    def write_rom(self, address, word):
+        self.rom[address] = word
+        self.program[address] = decode(word)
+
+    def instructions_per_second(self):
+        return self.cycles / self.elapsed if self.elapsed else 0.0
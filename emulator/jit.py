@@ -0,0 +1,143 @@
+import time
+
+from hack_cpu import ADDRESS_MASK, COMP_EXPRESSIONS, HackCPU, alu
+
+MAX_BLOCK_LENGTH = 256
+UNCONDITIONAL_JUMP = 0b1110101010000111 # 0;JMP
+HOT_THRESHOLD = 8 # entries into a block before it is compiled
+
+class Block:
+    __slots__ = ('start', 'length', 'function', 'hits', 'spins')
+
+    def __init__(self, start, length, function, spins=False):
+        self.start = start
+        self.length = length
+        self.function = function
+        self.hits = 0
+        # (X) @X 0;JMP, the usual way of halting a Hack program: nothing but A ever changes
+        self.spins = spins
+
+class JitCPU(HackCPU):
+    # A basic block is a run of instructions that ends with a jump, right before a leader
+    # (a label address from the assembler's first_pass), or at the end of the program.
+    # Blocks are interpreted until they have been entered HOT_THRESHOLD times, then compiled
+    # into a Python function that runs the whole block and returns the new (a, d, pc).
+    def __init__(self, rom, leaders=(), hot_threshold=HOT_THRESHOLD):
+        super().__init__(rom)
+        self.leaders = set(leaders)
+        self.hot_threshold = hot_threshold
+        self.blocks = {} # start address -> compiled Block
+        self.block_lengths = {} # start address -> length of the block starting there
+        self.entries = {} # start address -> times the block was interpreted
+        self.block_hits = 0
+        self.blocks_compiled = 0
+        self.compile_time = 0.0
+        self.interpreted_cycles = 0
+
+    def _block_length(self, start):
+        length = self.block_lengths.get(start)
+        if length is None:
+            end, size = start, len(self.program)
+            while end < size and end - start < MAX_BLOCK_LENGTH:
+                end += 1
+                if self.program[end - 1][4] or end in self.leaders: # ends with a jump, or next is a leader
+                    break
+            length = self.block_lengths[start] = end - start
+        return length
+
+    def _execute(self, max_cycles):
+        ram, blocks, entries = self.ram, self.blocks, self.entries
+        size = len(self.program)
+        cycles = 0
+        while cycles < max_cycles and self.pc < size:
+            pc = self.pc
+            block = blocks.get(pc)
+            remaining = max_cycles - cycles
+            if block is not None and block.spins and remaining >= 2:
+                iterations = remaining // 2
+                self.a = pc
+                block.hits += iterations
+                self.block_hits += iterations
+                cycles += 2 * iterations
+                continue
+            if block is not None and block.length <= remaining:
+                self.a, self.d, self.pc = block.function(ram, self.a, self.d)
+                block.hits += 1
+                self.block_hits += 1
+                cycles += block.length
+                continue
+            length = self._block_length(pc)
+            if block is None:
+                count = entries[pc] = entries.get(pc, 0) + 1
+                if count >= self.hot_threshold:
+                    self._compile(pc, length)
+            executed = HackCPU._execute(self, min(length, remaining))
+            self.interpreted_cycles += executed
+            cycles += executed
+        return cycles
+
+    def _compile(self, start, length):
+        begin = time.perf_counter()
+        source = generate_block_source(self.rom, start, length)
+        namespace = {'alu': alu}
+        exec(source, namespace)
+        spins = length == 2 and self.rom[start] == start and self.rom[start + 1] == UNCONDITIONAL_JUMP
+        self.blocks[start] = Block(start, length, namespace['block'], spins)
+        self.blocks_compiled += 1
+        self.compile_time += time.perf_counter() - begin
+
+    def write_rom(self, address, word):
+        # drops every block that covers the changed address
+        super().write_rom(address, word)
+        for start in [start for start, length in self.block_lengths.items() if start <= address < start + length]:
+            self.blocks.pop(start, None)
+            self.block_lengths.pop(start)
+            self.entries.pop(start, None)
+
+    def stats(self):
+        return {
+            'blocks_compiled': self.blocks_compiled,
+            'block_hits': self.block_hits,
+            'compile_time': self.compile_time,
+            'interpreted_cycles': self.interpreted_cycles
+        }
+
+def generate_block_source(rom, start, length):
+    # Python source of block(ram, a, d) -> (a, d, pc). While the value of A is known at
+    # compile time (right after an A-instruction), memory accesses use it as a literal.
+    lines = ['def block(ram, a, d):']
+    known_a = None
+    for pc in range(start, start + length):
+        word = rom[pc]
+        if not word & 0x8000:
+            lines.append(f'    a = {word}')
+            known_a = word
+            continue
+        comp, dest, jump = (word >> 6) & 0x7F, (word >> 3) & 0b111, word & 0b111
+        address = str(known_a) if known_a is not None else f'a & {ADDRESS_MASK}'
+        target = str(known_a) if known_a is not None else f'target & {ADDRESS_MASK}'
+        if comp & 0b1000000:
+            lines.append(f'    m = ram[{address}]')
+        expression = COMP_EXPRESSIONS.get(comp, f'alu({comp}, a, d, {"m" if comp & 0b1000000 else 0})')
+        lines.append(f'    out = {expression}')
+        if jump and known_a is None:
+            lines.append('    target = a')
+        if dest & 0b001:
+            lines.append(f'    ram[{address}] = out')
+        if dest & 0b100:
+            lines.append('    a = out')
+            known_a = None
+        if dest & 0b010:
+            lines.append('    d = out')
+        if jump == 0b111:
+            lines.append(f'    return a, d, {target}')
+            return '\n'.join(lines) + '\n'
+        if jump:
+            conditions = []
+            if jump & 0b100: conditions.append('out < 0')
+            if jump & 0b010: conditions.append('out == 0')
+            if jump & 0b001: conditions.append('out > 0')
+            lines.append(f'    if {" or ".join(conditions)}:')
+            lines.append(f'        return a, d, {target}')
+    lines.append(f'    return a, d, {start + length}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,175 @@
+import io
+import json
+import os
+import sys
+from collections import Counter, defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'assembler'))
+sys.path.insert(0, os.path.join(ROOT, 'vm_translator'))
+
+import assembler
+import vm_translator
+from hack_cpu import HackCPU, load_hack
+
+UNMAPPED = '(unmapped)'
+
+def load_source_map(filename):
+    with open(filename, 'r') as file:
+        return json.load(file)
+
+def build_program(abs_path, **options):
+    # translates a .vm file or a directory with source map markers and assembles it in memory;
+    # returns (ROM words, source map)
+    buffer = io.StringIO()
+    code_writer = vm_translator.CodeWriter(buffer, source_map=True, **options)
+    files = vm_translator.vm_files(abs_path) if os.path.isdir(abs_path) else [abs_path]
+    code_writer.write_stream(vm_translator.stream_sources(files, numbered=True))
+    asm_lines = buffer.getvalue().splitlines()
+    parsed_lines = assembler.parse_lines(asm_lines)
+    words = [int(line, 2) for line in assembler.second_pass(parsed_lines, assembler.first_pass(parsed_lines))]
+    return words, assembler.build_source_map(asm_lines)
+
+def range_cycles(source_map, counts):
+    # [(first address, cycles, file, line, function, command)] for every range of the map
+    ranges, rows = source_map['ranges'], []
+    for i in range(0, len(ranges), 5):
+        start, file, line, function, command = ranges[i:i + 5]
+        end = ranges[i + 5] if i + 5 < len(ranges) else source_map['size']
+        rows.append((start, sum(counts[start:end]), source_map['files'][file], line,
+                     source_map['functions'][function], source_map['commands'][command]))
+    return rows
+
+def strongly_connected(graph):
+    # {function: id of its strongly connected component} (Tarjan), so that recursion can be
+    # treated as a single node of the call graph
+    index, low, on_stack, stack, component = {}, {}, set(), [], {}
+    def visit(node):
+        index[node] = low[node] = len(index)
+        stack.append(node)
+        on_stack.add(node)
+        for callee in graph.get(node, ()):
+            if callee not in index:
+                visit(callee)
+                low[node] = min(low[node], low[callee])
+            elif callee in on_stack:
+                low[node] = min(low[node], index[callee])
+        if low[node] == index[node]:
+            while True:
+                member = stack.pop()
+                on_stack.discard(member)
+                component[member] = node
+                if member == node:
+                    break
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, 10 * len(graph) + 1000))
+    try:
+        for node in list(graph):
+            if node not in index:
+                visit(node)
+    finally:
+        sys.setrecursionlimit(limit)
+    return component
+
+def profile(source_map, counts):
+    # Cycle totals of a run, from the per-address execution counts and the source map:
+    # {'total', 'exclusive': {function: cycles}, 'inclusive': {function: cycles},
+    #  'calls': {function: calls}, 'commands': {command type: cycles}, 'lines': [...]}
+    # Exclusive cycles are the ones spent in a function's own code. Inclusive cycles add the
+    # callees, like gprof: the inclusive cycles of a function are shared among its callers in
+    # proportion to the number of calls each of them made, and mutually recursive functions
+    # are handled as one unit (each of them is reported with the cycles of the whole unit).
+    rows = range_cycles(source_map, counts)
+    exclusive, commands = Counter(), Counter()
+    arcs = defaultdict(Counter) # caller -> callee -> number of calls
+    mapped = 0
+    for start, cycles, file, line, function, command in rows:
+        exclusive[function] += cycles
+        commands[command.split()[0]] += cycles
+        mapped += cycles
+        if command.startswith('call '):
+            # the first instruction of a call runs exactly once per call
+            arcs[function][command.split()[1]] += counts[start]
+    total = sum(counts)
+    if total > mapped:
+        exclusive[UNMAPPED] += total - mapped
+    functions = set(exclusive) | {callee for callees in arcs.values() for callee in callees}
+    graph = {function: set(arcs.get(function, ())) for function in functions}
+    component = strongly_connected(graph)
+    calls = Counter()
+    external_calls = Counter() # calls into a component from outside of it
+    for caller, callees in arcs.items():
+        for callee, count in callees.items():
+            calls[callee] += count
+            if component[caller] != component[callee]:
+                external_calls[component[callee]] += count
+    members = defaultdict(list)
+    for function in functions:
+        members[component[function]].append(function)
+    component_inclusive = {}
+    def inclusive_of(unit):
+        # the components reachable from unit are visited first; the condensed graph has no cycles
+        if unit in component_inclusive:
+            return component_inclusive[unit]
+        cycles = sum(exclusive[member] for member in members[unit])
+        for member in members[unit]:
+            for callee, count in arcs.get(member, {}).items():
+                target = component[callee]
+                if target != unit and external_calls[target]:
+                    cycles += inclusive_of(target) * count / external_calls[target]
+        component_inclusive[unit] = cycles
+        return cycles
+    inclusive = {function: round(inclusive_of(component[function])) for function in functions}
+    lines = sorted(((cycles, f'{file}:{line}', command) for _, cycles, file, line, _, command in rows if cycles),
+                   reverse=True)
+    return {'total': total, 'exclusive': dict(exclusive), 'inclusive': inclusive, 'calls': dict(calls),
+            'commands': dict(commands), 'lines': lines}
+
+def print_profile(report, top=10):
+    total = report['total'] or 1
+    print(f"{report['total']} cycles")
+    print(f"\n{'inclusive':>12} {'%':>6} {'exclusive':>12} {'%':>6} {'calls':>10}  function")
+    for function in sorted(report['inclusive'], key=lambda f: (-report['inclusive'][f], f)):
+        inclusive, exclusive = report['inclusive'][function], report['exclusive'].get(function, 0)
+        print(f"{inclusive:12} {100 * inclusive / total:6.1f} {exclusive:12} {100 * exclusive / total:6.1f} "
+              f"{report['calls'].get(function, 0):10}  {function}")
+    print(f"\n{'cycles':>12} {'%':>6}  command type")
+    for command, cycles in sorted(report['commands'].items(), key=lambda item: -item[1]):
+        print(f"{cycles:12} {100 * cycles / total:6.1f}  {command}")
+    print(f"\n{'cycles':>12} {'%':>6}  VM command")
+    for cycles, location, command in report['lines'][:top]:
+        print(f"{cycles:12} {100 * cycles / total:6.1f}  {location} {command}")
+
+def main():
+    usage = ("Usage: python3 profiler.py [--cycles=N] [--compact] [--peephole] [--cache-top] path/to/file.vm|path/to/directory\n"
+             "OR\npython3 profiler.py [--cycles=N] program.hack program.map")
+    args = sys.argv[1:]
+    cycles, options = 1000000, {}
+    for arg in list(args):
+        if arg.startswith('--cycles='):
+            cycles = int(arg.split('=', 1)[1])
+        elif arg == '--compact':
+            options['compact'] = True
+        elif arg == '--peephole':
+            options['peephole'] = vm_translator.PEEPHOLE_RULES
+        elif arg == '--cache-top':
+            options['cache_top'] = True
+        elif arg.startswith('--'):
+            print(usage)
+            return
+        else:
+            continue
+        args.remove(arg)
+    if len(args) == 2 and args[1].endswith('.map'):
+        words, source_map = load_hack(args[0]), load_source_map(args[1])
+    elif len(args) == 1 and os.path.exists(args[0]):
+        words, source_map = build_program(os.path.abspath(args[0]), **options)
+    else:
+        print(usage)
+        return
+    cpu = HackCPU(words, profile=True)
+    cpu.run(cycles)
+    print_profile(profile(source_map, cpu.counts))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+import io
+import os
+import re
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'assembler'))
+sys.path.insert(0, os.path.join(ROOT, 'vm_translator'))
+
+import assembler
+import vm_translator
+from hack_cpu import HackCPU
+from jit import JitCPU
+from vm_interpreter import SEGMENT_POINTERS, VMInterpreter, load_program
+
+DEFAULT_TESTS = os.path.join(ROOT, 'vm_translator', 'Tests')
+
+def translate_dir(test_dir, **options):
+    # translates every .vm file of a test directory in memory; like the course tools, the
+    # bootstrap code is only added when there is a Sys.vm to call
+    files = sorted(file for file in os.listdir(test_dir) if file.endswith('.vm'))
+    lines = {}
+    for file in files:
+        lines[file.split('.')[0]] = vm_translator.read_file(os.path.join(test_dir, file))
+    buffer = io.StringIO()
+    code_writer = vm_translator.CodeWriter(buffer, **options)
+    code_writer.write(vm_translator.parse_lines(lines), bootstrap='Sys.vm' in files)
+    return buffer.getvalue()
+
+def assemble(asm_text):
+    # returns (ROM words, ROM addresses of the labels)
+    parsed_lines = assembler.parse_lines(asm_text.splitlines())
+    symbol_table = assembler.first_pass(parsed_lines)
+    words = [int(line, 2) for line in assembler.second_pass(parsed_lines, symbol_table)]
+    return words, set(symbol_table['ROM addresses'].values())
+
+def create_cpu(asm_text, jit=False, profile=False):
+    words, leaders = assemble(asm_text)
+    return JitCPU(words, leaders) if jit else HackCPU(words, profile)
+
+def parse_script(filename):
+    # splits a .tst script into (command, argument string) pairs; repeat blocks become
+    # ('repeat', (count, body))
+    with open(filename, 'r') as file:
+        text = file.read()
+    text = re.sub(r'/\*.*?\*/', '', text, flags=re.DOTALL)
+    text = re.sub(r'//[^\n]*', '', text)
+    tokens = re.findall(r'[{}]|[^,;{}]+', text)
+    return _parse_block(iter(tokens))
+
+def _parse_block(tokens):
+    commands = []
+    for token in tokens:
+        token = token.strip()
+        if not token:
+            continue
+        if token == '}':
+            return commands
+        if token == '{':
+            count, _ = commands.pop()[1]
+            commands.append(('repeat', (count, _parse_block(tokens))))
+            continue
+        command, _, argument = token.partition(' ')
+        if command == 'repeat':
+            commands.append(('repeat', (int(argument.strip()), [])))
+        else:
+            commands.append((command, argument.strip()))
+    return commands
+
+def parse_compare_file(filename):
+    # the rows of values in a .cmp file, as lists of ints (header rows are skipped)
+    rows = []
+    with open(filename, 'r') as file:
+        for line in file:
+            cells = [cell.strip() for cell in line.strip().strip('|').split('|')]
+            if cells and all(re.fullmatch(r'-?\d+', cell) for cell in cells):
+                rows.append([int(cell) for cell in cells])
+    return rows
+
+VM_POINTERS = {'sp': 0, **SEGMENT_POINTERS}
+
+def _read_location(cpu, name):
+    match = re.fullmatch(r'RAM\[(\d+)\]', name)
+    if match:
+        return cpu.ram[int(match.group(1))]
+    return {'A': cpu.a, 'D': cpu.d, 'PC': cpu.pc}[name]
+
+def _write_location(cpu, name, value):
+    match = re.fullmatch(r'RAM\[(\d+)\]', name)
+    segment = re.fullmatch(r'(local|argument|this|that)\[(\d+)\]', name)
+    if match:
+        cpu.ram[int(match.group(1))] = value
+    elif name in VM_POINTERS: # VM emulator scripts
+        cpu.ram[VM_POINTERS[name]] = value
+    elif segment:
+        cpu.ram[cpu.ram[VM_POINTERS[segment.group(1)]] + int(segment.group(2))] = value
+    elif name == 'A':
+        cpu.a = value
+    elif name == 'D':
+        cpu.d = value
+    elif name == 'PC':
+        cpu.pc = value
+
+def run_commands(cpu, commands, state):
+    for command, argument in commands:
+        if command == 'set':
+            name, value = argument.split()
+            _write_location(cpu, name, int(value))
+        elif command == 'repeat':
+            count, body = argument
+            if body in ([('ticktock', '')], [('vmstep', '')]):
+                cpu.run(count)
+            else:
+                for _ in range(count):
+                    run_commands(cpu, body, state)
+        elif command in ('ticktock', 'vmstep'):
+            cpu.run(1)
+        elif command == 'output-list':
+            state['output_list'] = [item.split('%')[0] for item in argument.split()]
+        elif command == 'output':
+            state['outputs'].append([_read_location(cpu, name) for name in state['output_list']])
+        # load, output-file and compare-to are handled by run_test
+
+def run_test(tst_filename, jit=False, profile=False, **options):
+    # returns (passed, outputs, expected, cpu)
+    test_dir = os.path.dirname(os.path.abspath(tst_filename))
+    cpu = create_cpu(translate_dir(test_dir, **options), jit, profile)
+    state = {'output_list': [], 'outputs': []}
+    commands = parse_script(tst_filename)
+    run_commands(cpu, commands, state)
+    compare_to = [argument for command, argument in commands if command == 'compare-to']
+    expected = parse_compare_file(os.path.join(test_dir, compare_to[0])) if compare_to else []
+    return state['outputs'] == expected, state['outputs'], expected, cpu
+
+def run_vm_test(tst_filename, profile=False):
+    # runs a *VME.tst script on the VM interpreter; returns (passed, outputs, expected, interpreter)
+    test_dir = os.path.dirname(os.path.abspath(tst_filename))
+    commands = parse_script(tst_filename)
+    loaded = [argument for command, argument in commands if command == 'load' and argument]
+    interpreter = VMInterpreter(load_program([os.path.join(test_dir, file) for file in loaded] or [test_dir]), profile)
+    state = {'output_list': [], 'outputs': []}
+    run_commands(interpreter, commands, state)
+    compare_to = [argument for command, argument in commands if command == 'compare-to']
+    expected = parse_compare_file(os.path.join(test_dir, compare_to[0])) if compare_to else []
+    return state['outputs'] == expected, state['outputs'], expected, interpreter
+
+def find_tests(paths, vm=False):
+    tests = []
+    for path in paths:
+        if os.path.isfile(path):
+            tests.append(path)
+            continue
+        for root, _, files in os.walk(path):
+            # *VME.tst scripts drive the VM emulator, the others the CPU emulator
+            tests.extend(os.path.join(root, file) for file in files if file.endswith('.tst') and file.endswith('VME.tst') == vm)
+    return sorted(tests)
+
+def main():
+    args = sys.argv[1:]
+    options = {}
+    if '--compact' in args:
+        args.remove('--compact')
+        options['compact'] = True
+    if '--peephole' in args:
+        args.remove('--peephole')
+        options['peephole'] = vm_translator.PEEPHOLE_RULES
+    if '--cache-top' in args:
+        args.remove('--cache-top')
+        options['cache_top'] = True
+    jit = '--jit' in args
+    if jit:
+        args.remove('--jit')
+    vm = '--vm' in args
+    if vm:
+        args.remove('--vm')
+    failed = 0
+    total_cycles, total_elapsed = 0, 0.0
+    start = time.perf_counter()
+    for tst_filename in find_tests(args or [DEFAULT_TESTS], vm):
+        if vm:
+            passed, outputs, expected, interpreter = run_vm_test(tst_filename)
+            total_cycles += interpreter.steps
+            total_elapsed += interpreter.elapsed
+            failed += not passed
+            print(f"{'PASS' if passed else 'FAIL'}  {os.path.basename(tst_filename):24} "
+                  f"{len(interpreter.program.commands):6} commands  {interpreter.steps:8} steps")
+            if not passed:
+                print(f"      expected {expected}\n      got      {outputs}")
+            continue
+        passed, outputs, expected, cpu = run_test(tst_filename, jit, **options)
+        total_cycles += cpu.cycles
+        total_elapsed += cpu.elapsed
+        failed += not passed
+        print(f"{'PASS' if passed else 'FAIL'}  {os.path.basename(tst_filename):24} "
+              f"{len(cpu.rom):6} words  {cpu.cycles:8} cycles  {cpu.instructions_per_second() / 1e6:6.2f} M instr/s")
+        if jit:
+            print("      {blocks_compiled} blocks compiled in {compile_time:.4f} s, {block_hits} block hits, "
+                  "{interpreted_cycles} cycles interpreted".format(**cpu.stats()))
+        if not passed:
+            print(f"      expected {expected}\n      got      {outputs}")
+    print(f"{failed} failed; {total_cycles} {'VM commands' if vm else 'instructions'} in {total_elapsed:.3f} s "
+          f"({total_cycles / total_elapsed / 1e6 if total_elapsed else 0:.2f} M/s), "
+          f"{time.perf_counter() - start:.3f} s total")
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+import os
+import sys
+import time
+from array import array
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'vm_translator'))
+
+import vm_translator
+from hack_cpu import RAM_SIZE
+
+# Every VM command is encoded as three ints (opcode, arg1, arg2) in one flat array. Push and
+# pop are specialized by segment so the interpreter never looks at segment names, labels are
+# resolved to instruction indexes (and take no step, as in the VM emulator), and static
+# variables to RAM addresses.
+(PUSH_CONSTANT, PUSH_SEGMENT, PUSH_FIXED, POP_SEGMENT, POP_FIXED,
+ ADD, SUB, NEG, EQ, GT, LT, AND, OR, NOT,
+ GOTO, IF_GOTO, FUNCTION, CALL, RETURN) = range(19)
+
+OPCODE_NAMES = ['push constant', 'push', 'push', 'pop', 'pop',
+                'add', 'sub', 'neg', 'eq', 'gt', 'lt', 'and', 'or', 'not',
+                'goto', 'if-goto', 'function', 'call', 'return']
+ARITHMETIC_OPCODES = {'add': ADD, 'sub': SUB, 'neg': NEG, 'eq': EQ, 'gt': GT, 'lt': LT, 'and': AND, 'or': OR, 'not': NOT}
+SEGMENT_POINTERS = {'local': 1, 'argument': 2, 'this': 3, 'that': 4} # RAM address holding the segment base
+SP, LCL, ARG, THIS, THAT = range(5)
+STATIC_BASE = 16
+# return addresses are instruction indexes stored in 16-bit RAM like any other value, so they
+# are kept as unsigned 16-bit numbers; the one after the last command must fit as well
+MAX_COMMANDS = 65535
+
+def _wrap(value):
+    return ((value + 32768) & 0xFFFF) - 32768
+
+class VMProgram:
+    # the encoded form of a set of parsed VM files (see vm_translator.parse_lines)
+    def __init__(self, parsed_lines):
+        self.code = array('i')
+        self.commands = [] # (file, VM command text) for every instruction, for reports
+        self.functions = {} # function name -> instruction index
+        self.function_of = [] # name of the function each instruction belongs to
+        self.statics = {} # 'File.i' -> RAM address, allocated in order of first use like the assembler does
+        labels = {}
+        fixups = [] # (code position, label or function name, is_function)
+        function = None
+        for file, lines in parsed_lines.items():
+            for line in lines:
+                parts = line.split()
+                command = parts[0]
+                if command == 'label':
+                    labels[(function, parts[1])] = len(self.commands)
+                    continue
+                position = len(self.code)
+                opcode, arg1, arg2 = self._encode(file, parts)
+                if command == 'function':
+                    function = parts[1]
+                    self.functions[function] = len(self.commands)
+                elif command in ('goto', 'if-goto'):
+                    fixups.append((position + 1, (function, parts[1]), False))
+                elif command == 'call':
+                    fixups.append((position + 1, parts[1], True))
+                self.code.extend((opcode, arg1, arg2))
+                self.commands.append((file, line))
+                self.function_of.append(function)
+        if len(self.commands) > MAX_COMMANDS:
+            raise ValueError(f"program too large: {len(self.commands)} VM commands, "
+                             f"return addresses only fit {MAX_COMMANDS}")
+        for position, name, is_function in fixups:
+            target = self.functions.get(name) if is_function else labels.get(name)
+            if target is None:
+                raise NameError(f"undefined {'function' if is_function else 'label'}: {name if is_function else name[1]}")
+            self.code[position] = target
+
+    def _encode(self, file, parts):
+        command = parts[0]
+        if command in ARITHMETIC_OPCODES:
+            return ARITHMETIC_OPCODES[command], 0, 0
+        if command == 'return':
+            return RETURN, 0, 0
+        if command in ('goto', 'if-goto'):
+            return (GOTO if command == 'goto' else IF_GOTO), 0, 0
+        if command == 'function':
+            return FUNCTION, int(parts[2]), 0
+        if command == 'call':
+            return CALL, 0, int(parts[2])
+        segment, index = parts[1], int(parts[2])
+        if segment == 'constant':
+            return PUSH_CONSTANT, index, 0
+        if segment in SEGMENT_POINTERS:
+            return (PUSH_SEGMENT if command == 'push' else POP_SEGMENT), SEGMENT_POINTERS[segment], index
+        if segment == 'temp':
+            address = 5 + index
+        elif segment == 'pointer':
+            address = THIS + index
+        else: # static
+            address = self.statics.setdefault(f'{file}.{index}', STATIC_BASE + len(self.statics))
+        return (PUSH_FIXED if command == 'push' else POP_FIXED), address, 0
+
+class VMInterpreter:
+    # Runs an encoded program on the Hack memory layout (SP, LCL, ARG, THIS and THAT in
+    # RAM[0..4], the stack from 256 on), with the same call/return frames as the translator.
+    # SP is kept in a local variable while run() executes and stored back to RAM[0] when it
+    # returns (or raises), so the RAM is up to date between run() calls.
+    def __init__(self, program, profile=False):
+        self.program = program
+        self.ram = array('h', bytes(2 * RAM_SIZE))
+        # like the VM emulator, start in Sys.init if there is one, else at the first command
+        self.pc = program.functions.get('Sys.init', 0)
+        self.steps = 0
+        self.elapsed = 0.0
+        self.counts = array('l', bytes(array('l').itemsize * len(program.commands))) if profile else None
+        # the flat code array unpacked into one (opcode, arg1, arg2) tuple per command, which
+        # is cheaper to fetch in the dispatch loop than three separate array reads
+        code = program.code
+        self.instructions = [tuple(code[i:i + 3]) for i in range(0, len(code), 3)]
+
+    def run(self, max_steps):
+        # executes up to max_steps VM commands and returns how many were executed
+        start = time.perf_counter()
+        steps = self._execute(max_steps)
+        self.elapsed += time.perf_counter() - start
+        self.steps += steps
+        return steps
+
+    def _execute(self, max_steps):
+        instructions, ram, counts = self.instructions, self.ram, self.counts
+        size = len(instructions)
+        pc = self.pc
+        sp = ram[SP]
+        steps = 0
+        try:
+            while steps < max_steps and pc < size:
+                if counts is not None:
+                    counts[pc] += 1
+                steps += 1
+                opcode, arg1, arg2 = instructions[pc]
+                pc += 1
+                if opcode == PUSH_SEGMENT:
+                    ram[sp] = ram[ram[arg1] + arg2]
+                    sp += 1
+                elif opcode == PUSH_CONSTANT:
+                    ram[sp] = arg1
+                    sp += 1
+                elif opcode == PUSH_FIXED:
+                    ram[sp] = ram[arg1]
+                    sp += 1
+                elif opcode == POP_SEGMENT:
+                    sp -= 1
+                    ram[ram[arg1] + arg2] = ram[sp]
+                elif opcode == POP_FIXED:
+                    sp -= 1
+                    ram[arg1] = ram[sp]
+                elif opcode == ADD:
+                    sp -= 1
+                    ram[sp - 1] = _wrap(ram[sp - 1] + ram[sp])
+                elif opcode == SUB:
+                    sp -= 1
+                    ram[sp - 1] = _wrap(ram[sp - 1] - ram[sp])
+                elif opcode == IF_GOTO:
+                    sp -= 1
+                    if ram[sp]:
+                        pc = arg1
+                elif opcode == GOTO:
+                    pc = arg1
+                elif opcode == LT:
+                    sp -= 1
+                    ram[sp - 1] = -1 if ram[sp - 1] < ram[sp] else 0
+                elif opcode == GT:
+                    sp -= 1
+                    ram[sp - 1] = -1 if ram[sp - 1] > ram[sp] else 0
+                elif opcode == EQ:
+                    sp -= 1
+                    ram[sp - 1] = -1 if ram[sp - 1] == ram[sp] else 0
+                elif opcode == AND:
+                    sp -= 1
+                    ram[sp - 1] &= ram[sp]
+                elif opcode == OR:
+                    sp -= 1
+                    ram[sp - 1] |= ram[sp]
+                elif opcode == NOT:
+                    ram[sp - 1] = ~ram[sp - 1]
+                elif opcode == NEG:
+                    ram[sp - 1] = _wrap(-ram[sp - 1])
+                elif opcode == CALL:
+                    ram[sp] = _wrap(pc) # return address
+                    ram[sp + 1] = ram[LCL]
+                    ram[sp + 2] = ram[ARG]
+                    ram[sp + 3] = ram[THIS]
+                    ram[sp + 4] = ram[THAT]
+                    sp += 5
+                    ram[ARG] = sp - 5 - arg2
+                    ram[LCL] = sp
+                    pc = arg1
+                elif opcode == FUNCTION:
+                    for _ in range(arg1):
+                        ram[sp] = 0
+                        sp += 1
+                elif opcode == RETURN:
+                    frame = ram[LCL]
+                    pc = ram[frame - 5] & 0xFFFF
+                    ram[ram[ARG]] = ram[sp - 1]
+                    sp = ram[ARG] + 1
+                    ram[THAT] = ram[frame - 1]
+                    ram[THIS] = ram[frame - 2]
+                    ram[ARG] = ram[frame - 3]
+                    ram[LCL] = ram[frame - 4]
+        finally:
+            ram[SP] = sp
+            self.pc = pc
+        return steps
+
+    def profile(self):
+        # (steps per function, steps per command type); only available with profile=True
+        per_function, per_command = Counter(), Counter()
+        code = self.program.code
+        for index, count in enumerate(self.counts):
+            if count:
+                per_function[self.program.function_of[index] or '(top level)'] += count
+                per_command[OPCODE_NAMES[code[3 * index]]] += count
+        return per_function, per_command
+
+def load_program(paths):
+    # encodes the given .vm files (directories are expanded to the .vm files they contain)
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, file) for file in sorted(os.listdir(path)) if file.endswith('.vm'))
+        else:
+            files.append(path)
+    lines = {os.path.basename(file).split('.')[0]: vm_translator.read_file(file) for file in files}
+    return VMProgram(vm_translator.parse_lines(lines))
+
+def main():
+    args = sys.argv[1:]
+    profile = '--profile' in args
+    if profile:
+        args.remove('--profile')
+    steps = 1000000
+    for arg in list(args):
+        if arg.startswith('--steps='):
+            steps = int(arg.split('=', 1)[1])
+            args.remove(arg)
+    if not args:
+        print("Usage: python3 vm_interpreter.py [--profile] [--steps=N] path/to/file.vm|path/to/directory ...")
+        return
+    interpreter = VMInterpreter(load_program(args), profile)
+    interpreter.ram[SP] = 256
+    executed = interpreter.run(steps)
+    print(f"{executed} VM commands in {interpreter.elapsed:.3f} s "
+          f"({executed / interpreter.elapsed / 1e6 if interpreter.elapsed else 0:.2f} M commands/s)")
+    if profile:
+        per_function, per_command = interpreter.profile()
+        for name, count in per_function.most_common():
+            print(f"{count:12}  {name}")
+        print()
+        for name, count in per_command.most_common():
+            print(f"{count:12}  {name}")
+
+if __name__ == "__main__":
+    main()
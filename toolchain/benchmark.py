@@ -0,0 +1,73 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from pipeline import ROOT, assembler, vm_translator, run_pipeline, write_stages
+from jack_compiler import handle_dir as compile_dir
+
+DEFAULT_TESTS = os.path.join(ROOT, 'vm_translator', 'Tests')
+
+def test_dirs(tests_dir):
+    # every directory with .vm files under tests_dir, sorted
+    dirs = []
+    for path, _, files in os.walk(tests_dir):
+        if any(file.endswith('.vm') for file in files):
+            dirs.append(path)
+    return sorted(dirs)
+
+def file_chain(abs_path):
+    # the tools one after the other, each reading the files the previous one wrote
+    if any(file.endswith('.jack') for file in os.listdir(abs_path)):
+        compile_dir(abs_path)
+    asm_filename, _ = vm_translator.handle_dir(abs_path)
+    return assembler.assemble_file(asm_filename)
+
+def in_memory(abs_path):
+    return write_stages(abs_path, run_pipeline(abs_path))[-1]
+
+def best_of(function, abs_path, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output_filename = function(abs_path)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    with open(output_filename, 'r') as file:
+        return best, file.read()
+
+def main():
+    usage = "Usage: python3 benchmark.py [--repeat=N] [path/to/tests or path/to/jack/project ...]"
+    args = sys.argv[1:]
+    repeat = 20
+    for arg in list(args):
+        if arg.startswith('--repeat='):
+            repeat = int(arg.split('=', 1)[1])
+            args.remove(arg)
+    if any(arg.startswith('--') or not os.path.isdir(arg) for arg in args):
+        print(usage)
+        return
+    dirs = []
+    for arg in args or [DEFAULT_TESTS]:
+        dirs.extend(test_dirs(arg) or [os.path.abspath(arg)])
+    totals = [0, 0]
+    print(f"{'program':24} {'ROM':>6} {'files':>9} {'in memory':>10}")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for test_dir in dirs:
+            # work on a copy, so that the bundled tests are not overwritten
+            work_dir = os.path.join(temp_dir, os.path.basename(test_dir))
+            shutil.copytree(test_dir, work_dir)
+            chain_time, chain_output = best_of(file_chain, work_dir, repeat)
+            pipeline_time, pipeline_output = best_of(in_memory, work_dir, repeat)
+            if chain_output != pipeline_output:
+                print(f"{os.path.basename(test_dir)}: the pipeline and the file chain produce different code")
+                sys.exit(1)
+            totals[0] += chain_time
+            totals[1] += pipeline_time
+            print(f"{os.path.basename(test_dir):24} {chain_output.count(chr(10)):6} "
+                  f"{chain_time * 1000:6.2f} ms {pipeline_time * 1000:7.2f} ms  ({chain_time / pipeline_time:.1f}x)")
+    print(f"{'total':31} {totals[0] * 1000:6.2f} ms {totals[1] * 1000:7.2f} ms  ({totals[0] / totals[1]:.1f}x)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+import os
+import sys
+from array import array
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'assembler'))
+sys.path.insert(0, os.path.join(ROOT, 'vm_translator'))
+sys.path.insert(0, os.path.join(ROOT, 'compiler'))
+
+import assembler
+import vm_translator
+from code_writer import CodeWriter as JackCodeWriter, OPTIMIZATIONS
+
+STAGES = ('vm', 'asm', 'hack')
+
+# Jack -> VM -> assembly -> machine code without intermediate files. The compiler and the
+# translator write into lists (one VM command or one assembly instruction per item, never with
+# comments), and each list is handed to the next stage as it is, so nothing is parsed, stripped or
+# split again. VM commands stay strings because the translator looks its translations up by the
+# command text. The machine code is kept as 16-bit words, and text files are only written for the
+# stages that are asked for.
+
+def compile_sources(sources, optimizations=()):
+    # {class name: Jack source} -> {class name: VM commands}
+    programs = {}
+    for class_name, source in sources.items():
+        commands = programs[class_name] = []
+        JackCodeWriter(source, commands, class_name + '.jack', optimizations)
+    return programs
+
+def translate_programs(programs, bootstrap=True, **options):
+    # {file name: VM commands} -> assembly instructions (and labels)
+    asm_lines = []
+    vm_translator.CodeWriter(asm_lines, comments=False, **options).write_stream(programs.items(), bootstrap)
+    return asm_lines
+
+def assemble_lines(asm_lines):
+    # assembly instructions -> machine code as an array of 16-bit words; generated code repeats
+    # the same few hundred instructions, so each distinct line is only encoded once
+    symbols = assembler.first_pass(asm_lines)
+    ram_symbols, rom_symbols = symbols['RAM addresses'], symbols['ROM addresses']
+    next_variable_address = 16
+    words = {}
+    program = array('H')
+    append = program.append
+    for line in asm_lines:
+        word = words.get(line)
+        if word is None:
+            if line[0] == '(':
+                continue
+            if line[0] == '@':
+                symbol = line[1:]
+                if symbol.isdigit():
+                    word = int(symbol)
+                elif symbol in ram_symbols:
+                    word = ram_symbols[symbol]
+                elif symbol in rom_symbols:
+                    word = rom_symbols[symbol]
+                else: # a variable, at the next free RAM address from 16 on, like second_pass
+                    word = ram_symbols[symbol] = next_variable_address
+                    next_variable_address += 1
+                if word > assembler.MAX_A_VALUE:
+                    raise assembler.a_value_error(line, word, len(program))
+            else:
+                word = int(assembler.translate_c_instruction(line), 2)
+            words[line] = word
+        append(word)
+    return program
+
+def hack_text(program):
+    # the .hack file format: one word per line, as 16 binary digits
+    texts = {}
+    lines = []
+    for word in program:
+        text = texts.get(word)
+        if text is None:
+            text = texts[word] = format(word, '016b')
+        lines.append(text)
+    return '\n'.join(lines) + '\n' if lines else ''
+
+def read_sources(abs_path, extension):
+    # {file name without extension: text} for a file, or for the files of a directory
+    if os.path.isdir(abs_path):
+        files = sorted(os.path.join(abs_path, file) for file in os.listdir(abs_path) if file.endswith(extension))
+    else:
+        files = [abs_path]
+    sources = {}
+    for file in files:
+        with open(file, 'r') as f:
+            sources[os.path.basename(file).split('.')[0]] = f.read()
+    return sources
+
+def run_pipeline(abs_path, optimizations=(), **options):
+    # runs every stage from the input's own (.jack or .vm files) to machine code; returns
+    # {'vm': {file name: VM commands}, 'asm': assembly lines, 'hack': machine code (words)}
+    if os.path.isdir(abs_path):
+        sources = read_sources(abs_path, '.jack')
+    else:
+        sources = read_sources(abs_path, '.jack') if abs_path.endswith('.jack') else {}
+    if sources:
+        programs = compile_sources(sources, optimizations)
+    else:
+        programs = {name: list(vm_translator.clean_lines(text.splitlines()))
+                    for name, text in read_sources(abs_path, '.vm').items()}
+    asm_lines = translate_programs(programs, **options)
+    return {'vm': programs, 'asm': asm_lines, 'hack': assemble_lines(asm_lines)}
+
+def write_stages(abs_path, results, stages=('hack',), output_format='hack'):
+    # serializes the requested stages next to the input, with the same file names as the
+    # separate tools; returns the files written
+    directory = abs_path if os.path.isdir(abs_path) else os.path.dirname(abs_path)
+    if os.path.isdir(abs_path):
+        base = os.path.join(abs_path, os.path.basename(abs_path))
+    else:
+        base = os.path.splitext(abs_path)[0]
+    written = []
+    if 'vm' in stages:
+        for name, commands in results['vm'].items():
+            filename = os.path.join(directory, name + '.vm')
+            with open(filename, 'w') as file:
+                file.write('\n'.join(commands) + '\n')
+            written.append(filename)
+    if 'asm' in stages:
+        with open(base + '.asm', 'w') as file:
+            file.write('\n'.join(results['asm']) + '\n')
+        written.append(base + '.asm')
+    if 'hack' in stages:
+        filename = base + assembler.OUTPUT_FORMATS[output_format]
+        if output_format == 'hack':
+            with open(filename, 'w') as file:
+                file.write(hack_text(results['hack']))
+        elif output_format == 'bin':
+            assembler.write_bin(filename, results['hack'])
+        else:
+            assembler.write_mmap(filename, results['hack'])
+        written.append(filename)
+    return written
+
+def main():
+    usage = ("Usage: python3 pipeline.py [--emit=vm,asm,hack] [--format=hack|bin|mmap] "
+             "[--optimize[=" + ','.join(OPTIMIZATIONS) + "]] [--compact] [--peephole] "
+             "path/to/file.jack|file.vm|directory")
+    args = sys.argv[1:]
+    stages, output_format, optimizations, options = ('hack',), 'hack', (), {}
+    for arg in list(args):
+        name, _, value = arg.partition('=')
+        if name == '--emit':
+            stages = tuple(value.split(','))
+        elif name == '--format':
+            output_format = value
+        elif name == '--optimize':
+            optimizations = tuple(value.split(',')) if value else OPTIMIZATIONS
+        elif arg == '--compact':
+            options['compact'] = True
+        elif arg == '--peephole':
+            options['peephole'] = vm_translator.PEEPHOLE_RULES
+        elif arg.startswith('--'):
+            args = []
+            break
+        else:
+            continue
+        args.remove(arg)
+    if (len(args) != 1 or not set(stages) <= set(STAGES) or output_format not in assembler.OUTPUT_FORMATS
+            or not set(optimizations) <= set(OPTIMIZATIONS)):
+        print(usage)
+        return
+    abs_path = os.path.abspath(args[0])
+    if not os.path.exists(abs_path):
+        print(f"no file or folder found: {args[0]}")
+        return
+    try:
+        results = run_pipeline(abs_path, optimizations, **options)
+    except (SyntaxError, ValueError) as e:
+        print(e)
+        sys.exit(1)
+    write_stages(abs_path, results, stages, output_format)
+
+if __name__ == "__main__":
+    main()
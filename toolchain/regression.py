@@ -0,0 +1,216 @@
+import gc
+import importlib.util
+import io
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+from pipeline import ROOT, assembler, vm_translator
+from code_writer import CodeWriter as JackCodeWriter
+from tokenizer import scan
+
+RESULTS_VERSION = 1
+STAGES = ('assembler', 'vm_translator', 'tokenizer', 'compiler')
+DEFAULT_THRESHOLD = 20 # percent
+
+def load_module(name, path):
+    # the benchmark.py of another project, under a name of its own
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+vm_benchmark = load_module('vm_benchmark', os.path.join(ROOT, 'vm_translator', 'benchmark.py'))
+
+def generate_statements(rng, depth, variables, classes, indent):
+    # a block of Jack statements with if/while blocks nested depth levels deep
+    pad = '    ' * indent
+    lines = []
+    for _ in range(3):
+        target, a, b = rng.choice(variables), rng.choice(variables), rng.choice(variables)
+        r = rng.random()
+        if r < 0.5:
+            lines.append(f'{pad}let {target} = ({a} + {rng.randrange(100)}) - ({b} & {rng.choice(variables)});\n')
+        elif r < 0.75:
+            lines.append(f'{pad}let {target} = Class{rng.randrange(classes)}.f{rng.randrange(4)}({a}, {b});\n')
+        else:
+            lines.append(f'{pad}do Class{rng.randrange(classes)}.f{rng.randrange(4)}({a} * 2, -{b});\n')
+    if depth > 0:
+        a, b = rng.choice(variables), rng.choice(variables)
+        keyword = rng.choice(('if', 'while'))
+        lines.append(f'{pad}{keyword} (({a} < {b}) & ~({a} = 0)) {{\n')
+        lines.extend(generate_statements(rng, depth - 1, variables, classes, indent + 1))
+        if keyword == 'while':
+            lines.append(f'{pad}    let {a} = {a} + 1;\n')
+        lines.append(f'{pad}}}\n')
+        if keyword == 'if':
+            lines[-1] = f'{pad}}} else {{\n'
+            lines.extend(generate_statements(rng, depth - 1, variables, classes, indent + 1))
+            lines.append(f'{pad}}}\n')
+    return lines
+
+def generate_project(classes=20, depth=6, seed=0):
+    # a deterministic Jack project: {class name: source} of classes calling each other, with
+    # control flow nested depth levels deep
+    rng = random.Random(seed)
+    project = {}
+    for c in range(classes):
+        lines = [f'class Class{c} {{\n', '    static int count;\n']
+        for f in range(4):
+            lines.append(f'    function int f{f}(int a, int b) {{\n')
+            lines.append('        var int x, y, z;\n')
+            lines.extend(generate_statements(rng, depth, ['a', 'b', 'x', 'y', 'z', 'count'], classes, 2))
+            lines.append('        return x;\n    }\n')
+        lines.append('}\n')
+        project[f'Class{c}'] = ''.join(lines)
+    return project
+
+def generate_corpora(scale=1):
+    # the inputs of every stage: an .asm program, a .vm program and a Jack project, all growing
+    # linearly with scale
+    vm_corpus = {name: [line.strip() for line in lines]
+                 for name, lines in vm_benchmark.generate_corpus(classes=50 * scale).items()}
+    asm_output = io.StringIO()
+    asm_source = vm_benchmark.generate_corpus(classes=10 * scale, seed=1)
+    vm_translator.CodeWriter(asm_output).write(vm_translator.parse_lines(asm_source))
+    return {
+        'asm': asm_output.getvalue().splitlines(),
+        'vm': vm_corpus,
+        'jack': generate_project(classes=20 * scale)
+    }
+
+def run_assembler(corpus):
+    parsed_lines = assembler.parse_lines(corpus['asm'])
+    symbol_table = assembler.first_pass(parsed_lines)
+    def run():
+        # second_pass adds the variables to the symbol table, so every run gets a fresh copy
+        return assembler.second_pass(parsed_lines, {name: dict(table) for name, table in symbol_table.items()})
+    return len(parsed_lines), run, len
+
+def run_vm_translator(corpus):
+    parsed_lines = vm_translator.parse_lines(corpus['vm'])
+    def run():
+        output = io.StringIO()
+        vm_translator.CodeWriter(output).write(parsed_lines)
+        return output.getvalue().splitlines()
+    return sum(len(lines) for lines in parsed_lines.values()), run, vm_translator.instruction_count
+
+def run_tokenizer(corpus):
+    def run():
+        return sum(1 for source in corpus['jack'].values() for _ in scan(source))
+    return sum(source.count('\n') for source in corpus['jack'].values()), run, lambda tokens: tokens
+
+def run_compiler(corpus):
+    def run():
+        commands = 0
+        for class_name, source in corpus['jack'].items():
+            output = io.StringIO()
+            JackCodeWriter(source, output, class_name + '.jack')
+            commands += output.getvalue().count('\n')
+        return commands
+    return sum(source.count('\n') for source in corpus['jack'].values()), run, lambda commands: commands
+
+SETUPS = {'assembler': run_assembler, 'vm_translator': run_vm_translator,
+          'tokenizer': run_tokenizer, 'compiler': run_compiler}
+
+def measure(stage, corpus, repeat=5):
+    # best time of repeat runs (with the garbage collector off, so that collections triggered by
+    # earlier stages do not land in the timings), then one more run under tracemalloc for the
+    # peak memory, which is not timed because tracing slows everything down
+    lines, run, output_size = SETUPS[stage](corpus)
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            result = run()
+            elapsed = time.perf_counter() - start
+        finally:
+            gc.enable()
+        best = elapsed if best is None else min(best, elapsed)
+    result = None
+    tracemalloc.start()
+    try:
+        result = run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'lines': lines, 'seconds': round(best, 6), 'lines_per_second': round(lines / best),
+            'peak_kb': round(peak / 1024), 'output': output_size(result)}
+
+def run_suite(scale=1, repeat=5, stages=STAGES):
+    corpus = generate_corpora(scale)
+    return {
+        'version': RESULTS_VERSION,
+        'python': platform.python_version(),
+        'settings': {'scale': scale, 'repeat': repeat},
+        'results': {stage: measure(stage, corpus, repeat) for stage in stages}
+    }
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    # the regressions of results against baseline: throughput lower or peak memory higher by more
+    # than threshold percent, or more output (instructions, tokens or VM commands) at all
+    if baseline.get('settings') != results['settings']:
+        return [f"the baseline was measured with other settings: {baseline.get('settings')}"]
+    regressions = []
+    for stage, current in results['results'].items():
+        previous = baseline['results'].get(stage)
+        if previous is None:
+            continue
+        if current['lines_per_second'] < previous['lines_per_second'] * (1 - threshold / 100):
+            regressions.append(f"{stage}: {current['lines_per_second']} lines/s, "
+                               f"baseline {previous['lines_per_second']} lines/s")
+        if current['peak_kb'] > previous['peak_kb'] * (1 + threshold / 100):
+            regressions.append(f"{stage}: peak memory {current['peak_kb']} KB, baseline {previous['peak_kb']} KB")
+        if current['output'] > previous['output']:
+            regressions.append(f"{stage}: output {current['output']}, baseline {previous['output']}")
+    return regressions
+
+def print_results(results, baseline=None):
+    print(f"{'stage':14} {'lines':>8} {'time':>10} {'lines/s':>10} {'peak':>10} {'output':>9}")
+    for stage, result in results['results'].items():
+        change = ''
+        previous = (baseline or {}).get('results', {}).get(stage)
+        if previous:
+            change = f"  ({result['lines_per_second'] / previous['lines_per_second'] - 1:+.1%})"
+        print(f"{stage:14} {result['lines']:8} {result['seconds'] * 1000:7.1f} ms {result['lines_per_second']:10} "
+              f"{result['peak_kb']:7} KB {result['output']:9}{change}")
+
+def main():
+    usage = ("Usage: python3 regression.py [--scale=N] [--repeat=N] [--stages=" + ','.join(STAGES) + "] "
+             "[--output=results.json] [--baseline=baseline.json] [--threshold=percent]")
+    settings = {'scale': '1', 'repeat': '5', 'stages': ','.join(STAGES), 'output': None, 'baseline': None,
+                'threshold': str(DEFAULT_THRESHOLD)}
+    for arg in sys.argv[1:]:
+        name, _, value = arg.partition('=')
+        if name[2:] not in settings or not arg.startswith('--'):
+            print(usage)
+            return
+        settings[name[2:]] = value
+    stages = tuple(settings['stages'].split(','))
+    if not set(stages) <= set(STAGES):
+        print(usage)
+        return
+    results = run_suite(int(settings['scale']), int(settings['repeat']), stages)
+    baseline = None
+    if settings['baseline']:
+        with open(settings['baseline'], 'r') as file:
+            baseline = json.load(file)
+    print_results(results, baseline)
+    if settings['output']:
+        with open(settings['output'], 'w') as file:
+            json.dump(results, file, indent=2)
+    if baseline is not None:
+        regressions = compare(results, baseline, float(settings['threshold']))
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+import io
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'assembler'))
+sys.path.insert(0, os.path.join(ROOT, 'vm_translator'))
+sys.path.insert(0, os.path.join(ROOT, 'compiler'))
+
+import assembler
+import vm_translator
+from code_writer import CodeWriter as JackCodeWriter, OPTIMIZATIONS
+from jack_compiler import jack_files
+
+LATENCY_WINDOW = 10000 # latencies kept per job type for the percentiles
+PERCENTILES = (50, 90, 99)
+
+def read_text(filename):
+    with open(filename, 'r') as file:
+        return file.read()
+
+def write_text(filename, text):
+    with open(filename, 'w') as file:
+        file.write(text)
+
+def percentile(sorted_values, p):
+    # nearest-rank percentile of an already sorted list
+    index = max(0, min(len(sorted_values) - 1, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+class Toolchain:
+    # Runs compile, translate and assemble jobs in one long-lived process. The modules (and the
+    # assembler tables) are imported once, and the result of every source file is kept in memory
+    # together with the source text it was produced from, so a file that did not change is not
+    # processed again. Jobs are run one at a time.
+
+    def __init__(self):
+        self.cache = {} # (job type, file, options) -> (source text, result)
+        self.written = {} # output file -> (result, (mtime, size)) of the last write
+        self.latencies = defaultdict(lambda: deque(maxlen=LATENCY_WINDOW))
+        self.lock = threading.Lock()
+        self.jobs = {'compile': self.compile, 'translate': self.translate, 'assemble': self.assemble}
+        self.running = True # cleared by a shutdown request
+
+    def _cached(self, key, source, produce, counts):
+        # the result for key if source did not change since it was produced, else produce(source)
+        entry = self.cache.get(key)
+        if entry is not None and entry[0] == source:
+            counts['hits'] += 1
+            return entry[1]
+        counts['misses'] += 1
+        result = produce(source)
+        self.cache[key] = (source, result)
+        return result
+
+    def _write_output(self, filename, result, write):
+        # write(filename) unless the file still holds what was last written for the same result
+        previous = self.written.get(filename)
+        if previous is not None and previous[0] == result:
+            try:
+                stat = os.stat(filename)
+                if (stat.st_mtime_ns, stat.st_size) == previous[1]:
+                    return
+            except OSError:
+                pass
+        write(filename)
+        stat = os.stat(filename)
+        self.written[filename] = (result, (stat.st_mtime_ns, stat.st_size))
+
+    def compile(self, path, optimize=()):
+        # compiles a .jack file, or every .jack file of a directory, into .vm files next to them
+        optimizations = tuple(OPTIMIZATIONS if optimize is True else optimize)
+        files = jack_files(path) if os.path.isdir(path) else [path]
+        counts = {'hits': 0, 'misses': 0}
+        outputs = []
+        for file in files:
+            def produce(source):
+                buffer = io.StringIO()
+                JackCodeWriter(source, buffer, os.path.basename(file), optimizations)
+                return buffer.getvalue()
+            vm_code = self._cached(('compile', file, optimizations), read_text(file), produce, counts)
+            output_filename = os.path.splitext(file)[0] + '.vm'
+            self._write_output(output_filename, vm_code, lambda filename: write_text(filename, vm_code))
+            outputs.append(output_filename)
+        return {'outputs': outputs, **counts}
+
+    def translate(self, path, **options):
+        # translates a .vm file, or the .vm files of a directory, into one .asm file; each file
+        # is kept as a relocatable fragment, like the --cache mode keeps them on disk
+        if options.get('peephole') is True:
+            options['peephole'] = vm_translator.PEEPHOLE_RULES
+        options = {name: tuple(value) if isinstance(value, list) else value for name, value in options.items()}
+        if os.path.isdir(path):
+            files = vm_translator.vm_files(path)
+            output_filename = os.path.join(path, os.path.basename(path) + '.asm')
+        else:
+            files = [path]
+            output_filename = os.path.splitext(path)[0] + '.asm'
+        buffer = io.StringIO()
+        code_writer = vm_translator.CodeWriter(buffer, **options)
+        code_writer._write_bootstrap()
+        counts = {'hits': 0, 'misses': 0}
+        key_options = tuple(sorted(options.items()))
+        for file in files:
+            file_basename = os.path.basename(file).split('.')[0]
+            def produce(source):
+                fragment, label_count, _ = vm_translator.translate_fragment(
+                    file_basename, source.splitlines(), **options)
+                return fragment, label_count
+            fragment, label_count = self._cached(('translate', file, key_options), read_text(file), produce, counts)
+            code_writer._write(vm_translator.relocate(fragment, code_writer.label_counter))
+            code_writer.label_counter += label_count
+        code_writer.flush()
+        asm_code = buffer.getvalue()
+        self._write_output(output_filename, asm_code, lambda filename: write_text(filename, asm_code))
+        return {'outputs': [output_filename], **counts}
+
+    def assemble(self, path, format='hack'):
+        if format not in assembler.OUTPUT_FORMATS:
+            raise ValueError(f"unknown output format: {format}")
+        counts = {'hits': 0, 'misses': 0}
+        def produce(source):
+            parsed_lines = assembler.parse_lines(source.splitlines())
+            return assembler.second_pass(parsed_lines, assembler.first_pass(parsed_lines))
+        binary_code = self._cached(('assemble', path), read_text(path), produce, counts)
+        output_filename = assembler.output_filename_for(path, format)
+        self._write_output(output_filename, binary_code,
+                           lambda filename: assembler.write_file(filename, binary_code, format))
+        return {'outputs': [output_filename], **counts}
+
+    def stats(self):
+        # request latency percentiles in milliseconds, per job type
+        report = {}
+        for job, latencies in self.latencies.items():
+            values = sorted(latencies)
+            report[job] = {'count': len(values), 'max': round(values[-1], 3)}
+            for p in PERCENTILES:
+                report[job][f'p{p}'] = round(percentile(values, p), 3)
+        return report
+
+    def handle(self, request):
+        # {"job": "compile" | "translate" | "assemble", "path": ..., options...}, {"job": "stats"}
+        # or {"job": "shutdown"}; returns {"ok": true, ...} or {"ok": false, "error": ...}, with
+        # the request's "id" if any
+        start = time.perf_counter()
+        response = {'id': request['id']} if 'id' in request else {}
+        job = request.get('job')
+        if not isinstance(job, str) or job not in self.jobs:
+            job_type = 'invalid'
+        else:
+            job_type = job
+        try:
+            if job in ('stats', 'shutdown'):
+                if job == 'shutdown':
+                    self.running = False
+                response.update(ok=True, stats=self.stats())
+                return response
+            if job_type == 'invalid':
+                raise ValueError(f"unknown job: {job!r}")
+            if not isinstance(request.get('path'), str):
+                raise ValueError("missing path")
+            options = {name: value for name, value in request.items() if name not in ('id', 'job', 'path')}
+            with self.lock:
+                result = self.jobs[job](os.path.abspath(request['path']), **options)
+            response.update(ok=True, **result)
+        except (SyntaxError, OSError, ValueError, TypeError) as e:
+            response.update(ok=False, error=str(e))
+        except Exception as e:
+            # anything else a bad input can raise (an unknown instruction or segment, a command
+            # without its operands) must not stop the server either
+            response.update(ok=False, error=f"{type(e).__name__}: {e}")
+        elapsed = (time.perf_counter() - start) * 1000
+        self.latencies[job_type].append(elapsed)
+        response['ms'] = round(elapsed, 3)
+        return response
+
+    def handle_line(self, line):
+        # one JSON request per line in, one JSON response per line out
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("a request must be a JSON object")
+        except ValueError as e:
+            return json.dumps({'ok': False, 'error': f"invalid request: {e}"})
+        return json.dumps(self.handle(request))
+
+def serve_stream(toolchain, input_file, output_file):
+    for line in input_file:
+        if not line.strip():
+            continue
+        output_file.write(toolchain.handle_line(line) + '\n')
+        output_file.flush()
+        if not toolchain.running:
+            break
+
+def serve_socket(toolchain, socket_path):
+    # every connection is a stream of requests, like stdin; connections are served in threads,
+    # but the jobs themselves run one at a time
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            serve_stream(toolchain, io.TextIOWrapper(self.rfile), io.TextIOWrapper(self.wfile, write_through=True))
+            if not toolchain.running:
+                self.server.shutdown()
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    with socketserver.ThreadingUnixStreamServer(socket_path, Handler) as server:
+        server.daemon_threads = True
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.remove(socket_path)
+
+def request(socket_path, requests):
+    # sends requests (dicts) over one connection to a running server and returns the responses
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(socket_path)
+        with connection.makefile('rw') as stream:
+            responses = []
+            for job in requests:
+                stream.write(json.dumps(job) + '\n')
+                stream.flush()
+                responses.append(json.loads(stream.readline()))
+            return responses
+
+def main():
+    usage = "Usage: python3 server.py [--socket=path/to/socket]"
+    args = sys.argv[1:]
+    socket_path = None
+    for arg in list(args):
+        if arg.startswith('--socket='):
+            socket_path = arg.split('=', 1)[1]
+            args.remove(arg)
+    if args or socket_path == '':
+        print(usage)
+        return
+    toolchain = Toolchain()
+    if socket_path:
+        serve_socket(toolchain, socket_path)
+    else:
+        serve_stream(toolchain, sys.stdin, sys.stdout)
+    print(json.dumps({'stats': toolchain.stats()}), file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
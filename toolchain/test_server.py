@@ -0,0 +1,61 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from server import Toolchain, request, serve_socket
+
+class ServerTest(unittest.TestCase):
+    # a failed job must be answered and must leave the server running for the next one
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.socket_path = os.path.join(self.directory.name, 'toolchain.sock')
+        self.thread = threading.Thread(target=serve_socket, args=(Toolchain(), self.socket_path), daemon=True)
+        self.thread.start()
+        for _ in range(100):
+            if os.path.exists(self.socket_path):
+                break
+            time.sleep(0.01)
+
+    def tearDown(self):
+        request(self.socket_path, [{'job': 'shutdown'}])
+        self.thread.join(5)
+        self.directory.cleanup()
+
+    def write(self, name, text):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w') as file:
+            file.write(text)
+        return path
+
+    def test_bad_job_then_good_job(self):
+        bad_asm = self.write('Bad.asm', '@1\nD=X\n')
+        bad_segment = self.write('BadSegment.vm', 'push foo 1\n')
+        short_command = self.write('Short.vm', 'pop\n')
+        good_asm = self.write('Good.asm', '@2\nD=A\n@3\nD=D+A\n@0\nM=D\n')
+        responses = request(self.socket_path, [
+            {'id': 1, 'job': 'assemble', 'path': bad_asm},
+            {'id': 2, 'job': 'translate', 'path': bad_segment},
+            {'id': 3, 'job': 'translate', 'path': short_command},
+            {'id': 4, 'job': 'assemble', 'path': good_asm}
+        ])
+        self.assertEqual([response['id'] for response in responses], [1, 2, 3, 4])
+        self.assertEqual([response['ok'] for response in responses], [False, False, False, True])
+        self.assertTrue(all(response['error'] for response in responses[:3]))
+        with open(os.path.join(self.directory.name, 'Good.hack'), 'r') as file:
+            self.assertEqual(len(file.read().split()), 6)
+        # a new connection is still served
+        self.assertTrue(request(self.socket_path, [{'job': 'stats'}])[0]['ok'])
+
+    def test_translate_with_source_map(self):
+        vm_file = self.write('Map.vm', 'push constant 7\n\npush constant 8\nadd\n')
+        response = request(self.socket_path, [{'job': 'translate', 'path': vm_file, 'source_map': True}])[0]
+        self.assertTrue(response['ok'], response)
+        with open(response['outputs'][0], 'r') as file:
+            markers = [line for line in file if line.startswith('//@ ')]
+        self.assertIn('//@ Map 4 - add\n', markers)
+
+if __name__ == "__main__":
+    unittest.main()
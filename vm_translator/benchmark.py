@@ -0,0 +1,98 @@
+import importlib.util
+import os
+import random
+import sys
+import tempfile
+import time
+
+import vm_translator
+
+SEGMENTS = ['constant', 'local', 'argument', 'this', 'that', 'static', 'temp', 'pointer']
+ARITHMETIC = ['add', 'sub', 'neg', 'eq', 'gt', 'lt', 'and', 'or', 'not']
+
+def generate_corpus(classes=200, functions=20, commands=60, seed=0):
+    # a deterministic synthetic program: {class name: list of VM lines}, shaped like compiler
+    # output (mostly push/pop and arithmetic, some control flow and calls)
+    rng = random.Random(seed)
+    names = [f'Class{i}' for i in range(classes)]
+    corpus = {}
+    for name in names:
+        lines = []
+        for f in range(functions):
+            lines.append(f'function {name}.f{f} {rng.randrange(4)}\n')
+            for c in range(commands):
+                r = rng.random()
+                if r < 0.45:
+                    segment = rng.choice(SEGMENTS)
+                    index = rng.randrange(2) if segment == 'pointer' else rng.randrange(8)
+                    lines.append(f'push {segment} {index}\n')
+                elif r < 0.65:
+                    segment = rng.choice(SEGMENTS[1:])
+                    index = rng.randrange(2) if segment == 'pointer' else rng.randrange(8)
+                    lines.append(f'pop {segment} {index}\n')
+                elif r < 0.85:
+                    lines.append(rng.choice(ARITHMETIC) + '\n')
+                elif r < 0.90:
+                    lines.append(f'label L{f}_{c}\n')
+                elif r < 0.95:
+                    lines.append(f'{rng.choice(["goto", "if-goto"])} L{f}_{rng.randrange(commands)}\n')
+                else:
+                    lines.append(f'call {rng.choice(names)}.f{rng.randrange(functions)} {rng.randrange(3)}\n')
+            lines.append('push constant 0\n')
+            lines.append('return\n')
+        corpus[name] = lines
+    return corpus
+
+def write_corpus(corpus, directory):
+    os.makedirs(directory, exist_ok=True)
+    for name, lines in corpus.items():
+        with open(os.path.join(directory, name + '.vm'), 'w') as file:
+            file.writelines(lines)
+
+def load_module(path):
+    spec = importlib.util.spec_from_file_location('baseline_vm_translator', path)
+    module = importlib.util.module_from_spec(spec)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(path)))
+    spec.loader.exec_module(module)
+    return module
+
+def measure(module, corpus, output_filename, **options):
+    # best of five; parsing is not timed, only CodeWriter (translation and writing the file)
+    parsed_lines = module.parse_lines(corpus)
+    best = None
+    for _ in range(5):
+        start = time.perf_counter()
+        code_writer = module.CodeWriter(output_filename, **options)
+        code_writer.write(parsed_lines)
+        code_writer.close()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    usage = "Usage: python3 benchmark.py [--classes=N] [--baseline=path/to/vm_translator.py] [--write=directory]"
+    settings = {'classes': '200', 'baseline': None, 'write': None}
+    for arg in sys.argv[1:]:
+        name, _, value = arg.partition('=')
+        if name[2:] not in settings or not arg.startswith('--'):
+            print(usage)
+            return
+        settings[name[2:]] = value
+    corpus = generate_corpus(classes=int(settings['classes']))
+    if settings['write']:
+        write_corpus(corpus, settings['write'])
+    line_count = sum(len(lines) for lines in corpus.values())
+    with tempfile.TemporaryDirectory() as directory:
+        output_filename = os.path.join(directory, 'out.asm')
+        results = []
+        if settings['baseline']:
+            results.append(('baseline', measure(load_module(settings['baseline']), corpus, output_filename)))
+        results.append(('current', measure(vm_translator, corpus, output_filename)))
+        results.append(('current, no comments', measure(vm_translator, corpus, output_filename, comments=False)))
+    print(f"corpus: {len(corpus)} files, {line_count} VM lines")
+    for name, elapsed in results:
+        speedup = f"  ({results[0][1] / elapsed:.1f}x)" if settings['baseline'] else ''
+        print(f"{name:22} {elapsed:7.3f} s  {line_count / elapsed / 1e3:8.1f} K lines/s{speedup}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+# Link-time dead-function elimination: the program is split into its functions, a call graph
+# is built from the call commands, and only the functions reachable from the roots (the
+# bootstrap only calls Sys.init) are kept. Commands in front of the first function of a file
+# are always kept, and the functions they call count as reachable.
+ROOTS = ('Sys.init',)
+
+def split_functions(lines):
+    # [(function name or None, commands)] in file order; None is the code before the first function
+    pieces = [(None, [])]
+    for line in lines:
+        if line.startswith('function '):
+            pieces.append((line.split()[1], []))
+        pieces[-1][1].append(line)
+    return pieces if pieces[0][1] else pieces[1:]
+
+def calls(commands):
+    return {command.split()[1] for command in commands if command.startswith('call ')}
+
+def call_graph(parsed_lines):
+    # {function name: names of the functions it calls}, for every file of the program
+    graph = {}
+    for lines in parsed_lines.values():
+        for name, commands in split_functions(lines):
+            if name is not None:
+                graph.setdefault(name, set()).update(calls(commands))
+    return graph
+
+def reachable(graph, roots):
+    seen = set()
+    stack = [root for root in roots if root in graph]
+    while stack:
+        name = stack.pop()
+        if name in seen:
+            continue
+        seen.add(name)
+        stack.extend(callee for callee in graph.get(name, ()) if callee not in seen)
+    return seen
+
+def eliminate_dead_functions(parsed_lines, roots=ROOTS):
+    # returns ({file: commands of the kept code}, [(function, file, commands)] removed); if no
+    # root is defined (a program without Sys.init), nothing is removed
+    split = {file: split_functions(lines) for file, lines in parsed_lines.items()}
+    graph = call_graph(parsed_lines)
+    if not any(root in graph for root in roots):
+        return dict(parsed_lines), []
+    roots = list(roots)
+    for pieces in split.values():
+        for name, commands in pieces:
+            if name is None:
+                roots.extend(calls(commands))
+    live = reachable(graph, roots)
+    kept, removed = {}, []
+    for file, pieces in split.items():
+        kept[file] = []
+        for name, commands in pieces:
+            if name is None or name in live:
+                kept[file].extend(commands)
+            else:
+                removed.append((name, file, commands))
+    return kept, removed
@@ -0,0 +1,56 @@
+from collections import Counter
+
+# Rewrites that fuse two adjacent VM commands. The optimizer yields the original command
+# strings unchanged, and a tuple (rule, *operands) in place of every fused pair; the
+# CodeWriter emits a single assembly sequence for those tuples.
+RULES = ('push-arith', 'push-pop', 'push-constant-if-goto', 'not-if-goto')
+
+BINARY_OPS = {'add', 'sub', 'and', 'or'}
+PUSHABLE_SEGMENTS = {'constant', 'local', 'argument', 'this', 'that', 'static', 'temp', 'pointer'}
+POPPABLE_SEGMENTS = PUSHABLE_SEGMENTS - {'constant'}
+
+def _fuse(first, second, rules):
+    # returns the fused tuple for the pair, or None if no enabled rule applies
+    if first[0] == 'push' and len(first) == 3 and first[1] in PUSHABLE_SEGMENTS:
+        segment, index = first[1], first[2]
+        if 'push-arith' in rules and len(second) == 1 and second[0] in BINARY_OPS:
+            return ('push-arith', segment, index, second[0])
+        if 'push-pop' in rules and second[0] == 'pop' and len(second) == 3 and second[1] in POPPABLE_SEGMENTS:
+            return ('push-pop', segment, index, second[1], second[2])
+        if 'push-constant-if-goto' in rules and segment == 'constant' and second[0] == 'if-goto':
+            return ('push-constant-if-goto', index, second[1])
+    if 'not-if-goto' in rules and first == ['not'] and second[0] == 'if-goto':
+        return ('not-if-goto', second[1])
+    return None
+
+def unfuse(fused):
+    # the two original commands of a fused tuple
+    rule = fused[0]
+    if rule == 'push-arith':
+        return [f'push {fused[1]} {fused[2]}', fused[3]]
+    if rule == 'push-pop':
+        return [f'push {fused[1]} {fused[2]}', f'pop {fused[3]} {fused[4]}']
+    if rule == 'push-constant-if-goto':
+        return [f'push constant {fused[1]}', f'if-goto {fused[2]}']
+    return ['not', f'if-goto {fused[1]}']
+
+def optimize(lines, rules=RULES, stats=None):
+    # lines are the cleaned-up VM commands of one file (see parse_lines); only a window of
+    # two commands is looked at, so this works on any iterable, including generators
+    if stats is None:
+        stats = Counter()
+    pending = None
+    for line in lines:
+        if pending is None:
+            pending = line
+            continue
+        fused = _fuse(pending.split(), line.split(), rules)
+        if fused is None:
+            yield pending
+            pending = line
+        else:
+            stats[fused[0]] += 1
+            yield fused
+            pending = None
+    if pending is not None:
+        yield pending
@@ -1,253 +1,791 @@
 import os, sys
-from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import hashlib, io, json, re
+from collections import Counter, defaultdict, deque
+from itertools import islice
+from peephole import RULES as PEEPHOLE_RULES, optimize, unfuse
+from linker import ROOTS, eliminate_dead_functions
+
+# generated label numbers in relocatable fragments are wrapped in this character
+RELOCATION_MARKER = '\x00'
+RELOCATION_PATTERN = re.compile(f'{RELOCATION_MARKER}(\\d+){RELOCATION_MARKER}')
+# cached fragments are only valid for the exact translator sources that produced them: this
+# module and the ones whose code ends up in a fragment (peephole.py fuses commands, linker.py is
+# hashed too, as it is imported by this module)
+def translator_version():
+    digest = hashlib.sha256()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for module in ('vm_translator.py', 'peephole.py', 'linker.py'):
+        with open(os.path.join(directory, module), 'rb') as file:
+            digest.update(file.read())
+    return digest.hexdigest()[:16]
+
+TRANSLATOR_VERSION = translator_version()
+CACHE_DIR_NAME = '.vmcache'
+STDIN_NAME = 'Stdin' # file name (the prefix of static symbols) for commands read from stdin
+# with source maps, the assembly of every VM command is preceded by a comment
+# '//@ file line function command' that the assembler turns into a source map
+SOURCE_MAP_MARKER = '//@ '
 
 def read_file(filename):
     with open(filename, 'r') as file:
         lines = file.readlines()
     return lines
 
+def clean_lines(lines):
+    # removes comments and whitespace from any iterable of raw lines (a list, an open file,
+    # sys.stdin), one line at a time
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('//'):
+            continue
+        yield line.split('//')[0].strip() # remove inline comments
+
+def number_lines(lines):
+    # like clean_lines, but yields (line number, command) pairs, counting from 1
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith('//'):
+            continue
+        yield number, line.split('//')[0].strip()
+
 def parse_lines(lines):
     parsed_lines = defaultdict(list)
     for k,v in lines.items():
-        for line in v:
-            line = line.strip()
-            if not line or line.startswith('//'):
-                continue
-            line = line.split('//')[0].strip() # remove inline comments
-            parsed_lines[k].append(line)
+        parsed_lines[k].extend(clean_lines(v))
     return parsed_lines
 
+def stream_file(filename, numbered=False):
+    # the cleaned-up commands of a VM file, read lazily; the file stays open until exhausted
+    with open(filename, 'r') as file:
+        yield from number_lines(file) if numbered else clean_lines(file)
+
+def vm_files(abs_path):
+    # the .vm files of a directory, sorted so that the output does not depend on os.listdir order
+    return sorted(os.path.join(abs_path, file) for file in os.listdir(abs_path) if file.endswith('.vm'))
+
+def stream_sources(files, numbered=False):
+    # (file basename, lazy command stream) for every file, opened one after the other
+    for file in files:
+        yield os.path.basename(file).split('.')[0], stream_file(file, numbered)
+
+SEGMENT_BASE = {'local': 'LCL', 'argument': 'ARG', 'this': 'THIS', 'that': 'THAT'}
+BINARY_OP_SYMBOLS = {'add': '+', 'sub': '-', 'and': '&', 'or': '|'}
+
+# assembly for every push/pop segment; {index}, {file}, {address} (temp) and {pointer} are
+# filled in by _write_push_pop
+PUSH_D = '@SP\nA=M\nM=D\n@SP\nM=M+1\n'
+POP_D = '@SP\nAM=M-1\nD=M\n'
+PUSH_TEMPLATES = {
+    'constant': '@{index}\nD=A\n' + PUSH_D,
+    'static': '@{file}.{index}\nD=M\n' + PUSH_D,
+    'temp': '@{address}\nD=M\n' + PUSH_D,
+    'pointer': '@{pointer}\nD=M\n' + PUSH_D,
+    **{segment: f'@{base}\nD=M\n@{{index}}\nA=D+A\nD=M\n' + PUSH_D for segment, base in SEGMENT_BASE.items()}
+}
+POP_TEMPLATES = {
+    'static': POP_D + '@{file}.{index}\nM=D\n',
+    'temp': POP_D + '@{address}\nM=D\n',
+    'pointer': POP_D + '@{pointer}\nM=D\n',
+    **{segment: f'@{base}\nD=M\n@{{index}}\nD=D+A\n@R13\nM=D\n' + POP_D + '@R13\nA=M\nM=D\n'
+       for segment, base in SEGMENT_BASE.items()}
+}
+ARITHMETIC_TEMPLATES = {
+    **{command: f'@SP\nAM=M-1\nD=M\nA=A-1\nM=M{symbol}D\n' for command, symbol in BINARY_OP_SYMBOLS.items()},
+    'not': '@SP\nA=M-1\nM=!M\n',
+    'neg': '@SP\nA=M-1\nM=-M\n'
+}
+COMPARE_JUMPS = {'eq': 'JEQ', 'gt': 'JGT', 'lt': 'JLT'}
+# what _write_push_pop writes for push constant 0, which initializes the locals of a function
+PUSH_ZERO = PUSH_TEMPLATES['constant'].format(index=0)
+PUSH_ZERO_COMMENTED = '// push constant 0\n' + PUSH_ZERO
+# with the stack top cached in D (cache_top), SP points at the slot the top would be stored in;
+# x is the value below it
+FLUSH_TOP = '@SP\nM=M+1\nA=M-1\nM=D\n' # stores D into that slot
+TOP_ARITHMETIC_TEMPLATES = {
+    'add': '@SP\nAM=M-1\nD=D+M\n', 'sub': '@SP\nAM=M-1\nD=M-D\n',
+    'and': '@SP\nAM=M-1\nD=D&M\n', 'or': '@SP\nAM=M-1\nD=D|M\n',
+    'not': 'D=!D\n', 'neg': 'D=-D\n'
+}
+# up to this index, popping D into local, argument, this or that walks A up from the base
+# (A=A+1 per step); beyond it, going through R13 and R14 is shorter
+MAX_INCREMENTS = 10
+# pushes LCL, ARG, THIS and THAT, the part of a call frame that is the same for every call
+SAVE_FRAME = ''.join(f'@{pointer}\nD=M\n' + PUSH_D for pointer in ('LCL', 'ARG', 'THIS', 'THAT'))
+# the commands whose assembly is kept in the memo: they generate no labels and do not name one,
+# so the memo stays as small as the set of distinct push, pop and arithmetic commands, however
+# long the program is (push and pop static are only kept until the end of their file)
+MEMO_COMMANDS = {'push', 'pop', 'add', 'sub', 'neg', 'and', 'or', 'not', 'return', 'push-arith', 'push-pop'}
+# the options after which main prints the ROM size with and without them
+SIZE_OPTIONS = ('compact', 'peephole', 'cache_top')
+FLUSH_CHUNK = 4096 # VM commands translated into the buffer before it is written out
+
 class CodeWriter:
-    def __init__(self, output_file):
-        self.file = open(output_file, 'w')
+    def __init__(self, output_file, relocatable=False, compact=False, peephole=(), comments=True, label_namespace=None,
+                 source_map=False, cache_top=False):
+        # output_file is a path, an already open text stream (e.g. io.StringIO) or a list, which
+        # gets one line of assembly per item
+        self.lines = output_file if isinstance(output_file, list) else None
+        self.file = open(output_file, 'w') if isinstance(output_file, str) else output_file
+        # generated assembly is collected here and written out in large chunks by flush()
+        self.buffer = []
+        self._write = self.buffer.append
+        # the assembly of the MEMO_COMMANDS seen so far, by command text
+        self.translations = {}
+        # the commands that name a label, by their first word; they are translated every time
+        self.label_commands = {'label': self._write_label, 'goto': self._write_goto, 'if-goto': self._write_if_goto,
+                               'call': self._write_call, 'function': self._write_function}
+        self.comments = comments
         self.label_counter = 0
+        self.relocatable = relocatable
+        # generated label numbers are prefixed with this (e.g. LABEL_Main.3), so that files
+        # translated by separate CodeWriters can be concatenated without label clashes
+        self.label_namespace = label_namespace
+        # compact mode: call, return and eq/gt/lt jump into shared routines emitted by the bootstrap
+        self.compact = compact
+        # names of the enabled peephole rules (see peephole.py) and how often each one fired
+        self.peephole = tuple(peephole)
+        self.peephole_stats = Counter()
+        # source map markers take the place of the comments; write_commands then takes
+        # (line number, command) pairs
+        self.source_map = source_map
+        if source_map:
+            self.comments = False
+        # cache_top keeps the top of the stack in D between commands where it can; top_in_d
+        # tells whether it is there right now. It is stored back to the stack (_flush_top) before
+        # labels, jumps, calls, returns and at the end of every file, so that every jump target
+        # and every file starts with the whole stack in RAM.
+        self.cache_top = cache_top
+        self.top_in_d = False
+
+    def _comment(self, text):
+        if self.comments:
+            self._write(f'// {text}\n')
+
+    def _marker(self, file_name, line_number, function_name, text):
+        self._write(f'{SOURCE_MAP_MARKER}{file_name} {line_number} {function_name} {text}\n')
+
+    def _flush_top(self):
+        if self.top_in_d:
+            self._write(FLUSH_TOP)
+            self.top_in_d = False
+
+    def flush(self):
+        if self.lines is not None:
+            self.lines.extend(''.join(self.buffer).splitlines())
+        else:
+            self.file.write(''.join(self.buffer))
+        self.buffer.clear()
+
+    def _label_id(self, counter):
+        # relocatable output wraps generated label numbers in markers, so that a translated
+        # fragment can later be moved to a different label_counter offset (see relocate)
+        if not self.relocatable and not self.label_namespace:
+            return str(counter)
+        label_id = f'{RELOCATION_MARKER}{counter}{RELOCATION_MARKER}' if self.relocatable else str(counter)
+        if self.label_namespace:
+            return f'{self.label_namespace}.{label_id}'
+        return label_id
     
     def _write_bootstrap(self):
-        self.file.write('// bootstrap code\n')
-        self.file.write('@256\nD=A\n@SP\nM=D\n') # set stack pointer to 256
+        self._comment('bootstrap code')
+        if self.source_map:
+            self._marker('-', 0, '(bootstrap)', 'bootstrap')
+        self._write('@256\nD=A\n@SP\nM=D\n') # set stack pointer to 256
+        if self.source_map:
+            self._marker('-', 0, '(bootstrap)', 'call Sys.init 0')
         self._write_call('Sys.init', '0')
+        if self.compact:
+            self._write_runtime()
 
-    def _write_arithmetic(self, command):
-        
-        self.file.write(f'// {command}\n')
+    def _write_runtime(self):
+        # Shared routines for compact mode. They sit right after the call to Sys.init, which
+        # never returns, so they are only ever reached by a jump.
+        self._comment('runtime: call (R13 = function, R14 = nArgs, D = return address)')
+        if self.source_map:
+            self._marker('-', 0, '(runtime)', 'call')
+        self._write('($$CALL)\n')
+        self._write('@SP\nA=M\nM=D\n') # push return address
+        self._write('@LCL\nD=M\n@SP\nAM=M+1\nM=D\n') # push LCL
+        self._write('@ARG\nD=M\n@SP\nAM=M+1\nM=D\n') # push ARG
+        self._write('@THIS\nD=M\n@SP\nAM=M+1\nM=D\n') # push THIS
+        self._write('@THAT\nD=M\n@SP\nAM=M+1\nM=D\n') # push THAT
+        self._write('@SP\nMD=M+1\n@LCL\nM=D\n') # LCL = SP
+        self._write('@R14\nD=D-M\n@5\nD=D-A\n@ARG\nM=D\n') # ARG = SP - 5 - nargs
+        self._write('@R13\nA=M\n0;JMP\n') # goto function
+        self._comment('runtime: return')
+        if self.source_map:
+            self._marker('-', 0, '(runtime)', 'return')
+        self._write('($$RETURN)\n')
+        self._write_return_sequence()
+        self._comment('runtime: eq, gt, lt (D = return address)')
+        if self.source_map:
+            self._marker('-', 0, '(runtime)', 'compare')
+        for command, jump in (('eq', 'JEQ'), ('gt', 'JGT'), ('lt', 'JLT')):
+            self._write(
+                f'($${command.upper()})\n@R15\nM=D\n@SP\nAM=M-1\nD=M\nA=A-1\nD=M-D\n'
+                f'@$$TRUE\nD;{jump}\n@$$FALSE\n0;JMP\n'
+            )
+        self._write('($$FALSE)\n@SP\nA=M-1\nM=0\n@R15\nA=M\n0;JMP\n')
+        self._write('($$TRUE)\n@SP\nA=M-1\nM=-1\n@R15\nA=M\n0;JMP\n')
 
-        def unique_label():
+    def _write_arithmetic(self, command):
+        if self.comments:
+            self._write(f'// {command}\n')
+        if self.top_in_d and (command in TOP_ARITHMETIC_TEMPLATES or not self.compact):
+            self._write_top_arithmetic(command)
+            return
+        self._flush_top()
+        if command in ARITHMETIC_TEMPLATES:
+            self._write(ARITHMETIC_TEMPLATES[command])
+        elif self.compact:
             self.label_counter += 1
-            return f"LABEL_{self.label_counter}"
-
-        if command == "add":
-            self.file.write('@SP\nAM=M-1\nD=M\nA=A-1\nM=M+D\n')
-        elif command == "sub":
-            self.file.write('@SP\nAM=M-1\nD=M\nA=A-1\nM=M-D\n')
-        elif command == "and":
-            self.file.write('@SP\nAM=M-1\nD=M\nA=A-1\nM=M&D\n')
-        elif command == "or":
-            self.file.write('@SP\nAM=M-1\nD=M\nA=A-1\nM=M|D\n')
-        elif command == "not":
-            self.file.write('@SP\nA=M-1\nM=!M\n')
-        elif command == "neg":
-            self.file.write('@SP\nA=M-1\nM=-M\n')
-        elif command == "eq":
-            label_true = unique_label()
-            label_end = unique_label()
-            self.file.write(
-                f'@SP\nAM=M-1\nD=M\nA=A-1\nD=M-D\n@{label_true}\nD;JEQ\n'
-                f'@SP\nA=M-1\nM=0\n@{label_end}\n0;JMP\n'
-                f'({label_true})\n@SP\nA=M-1\nM=-1\n({label_end})\n'
-            )
-        elif command == "gt":
-            label_true = unique_label()
-            label_end = unique_label()
-            self.file.write(
-                f'@SP\nAM=M-1\nD=M\nA=A-1\nD=M-D\n@{label_true}\nD;JGT\n'
-                f'@SP\nA=M-1\nM=0\n@{label_end}\n0;JMP\n'
-                f'({label_true})\n@SP\nA=M-1\nM=-1\n({label_end})\n'
-            )
-        elif command == "lt":
-            label_true = unique_label()
-            label_end = unique_label()
-            self.file.write(
-                f'@SP\nAM=M-1\nD=M\nA=A-1\nD=M-D\n@{label_true}\nD;JLT\n'
-                f'@SP\nA=M-1\nM=0\n@{label_end}\n0;JMP\n'
-                f'({label_true})\n@SP\nA=M-1\nM=-1\n({label_end})\n'
+            return_label = f'LABEL_{self._label_id(self.label_counter)}'
+            self._write(f'@{return_label}\nD=A\n@$${command.upper()}\n0;JMP\n({return_label})\n')
+        else:
+            true = self._label_id(self.label_counter + 1)
+            end = self._label_id(self.label_counter + 2)
+            self.label_counter += 2
+            self._write(
+                f'@SP\nAM=M-1\nD=M\nA=A-1\nD=M-D\n@LABEL_{true}\nD;{COMPARE_JUMPS[command]}\n'
+                f'@SP\nA=M-1\nM=0\n@LABEL_{end}\n0;JMP\n'
+                f'(LABEL_{true})\n@SP\nA=M-1\nM=-1\n(LABEL_{end})\n'
             )
 
+    def _write_top_arithmetic(self, command):
+        # y is in D and x at RAM[SP-1]; the result is left in D
+        if command in TOP_ARITHMETIC_TEMPLATES:
+            self._write(TOP_ARITHMETIC_TEMPLATES[command])
+            return
+        true = self._label_id(self.label_counter + 1)
+        end = self._label_id(self.label_counter + 2)
+        self.label_counter += 2
+        self._write(
+            f'@SP\nAM=M-1\nD=M-D\n@LABEL_{true}\nD;{COMPARE_JUMPS[command]}\n'
+            f'D=0\n@LABEL_{end}\n0;JMP\n(LABEL_{true})\nD=-1\n(LABEL_{end})\n'
+        )
+
     def _write_push_pop(self, command, segment, index, file_name):
         index = int(index)
-        self.file.write(f'// {command} {segment} {index}\n')
-        if command == 'push':
-            if segment == 'constant':
-                self.file.write(f'@{index}\nD=A\n@SP\nA=M\nM=D\n@SP\nM=M+1\n')
-            elif segment in ('local', 'argument', 'this', 'that'):
-                segment_base = {
-                    'local': 'LCL',
-                    'argument': 'ARG',
-                    'this': 'THIS',
-                    'that': 'THAT'
-                }
-                self.file.write(
-                    f'@{segment_base[segment]}\nD=M\n@{index}\nA=D+A\nD=M\n@SP\nA=M\nM=D\n@SP\nM=M+1\n'
-                )
-            elif segment == 'static':
-                self.file.write(
-                    f'@{file_name}.{index}\nD=M\n@SP\nA=M\nM=D\n@SP\nM=M+1\n'
-                )
-            elif segment == 'temp':
-                self.file.write(
-                    f'@{5+index}\nD=M\n@SP\nA=M\nM=D\n@SP\nM=M+1\n'
-                )
-            elif segment == 'pointer':
-                if index == 0:
-                    self.file.write(
-                        f'@THIS\nD=M\n@SP\nA=M\nM=D\n@SP\nM=M+1\n'
-                    )
-                elif index == 1:
-                    self.file.write(
-                        f'@THAT\nD=M\n@SP\nA=M\nM=D\n@SP\nM=M+1\n'
-                    )
-
-        elif command == 'pop':
-            if segment in ('local', 'argument', 'this', 'that'):
-                segment_base = {
-                    'local': 'LCL',
-                    'argument': 'ARG',
-                    'this': 'THIS',
-                    'that': 'THAT'
-                }
-                self.file.write(
-                    f'@{segment_base[segment]}\nD=M\n@{index}\nD=D+A\n@R13\nM=D\n@SP\nAM=M-1\nD=M\n@R13\nA=M\nM=D\n'
-                )
-            elif segment == 'static':
-                self.file.write(
-                    f'@SP\nAM=M-1\nD=M\n@{file_name}.{index}\nM=D\n'
-                )
-            elif segment == 'temp':
-                self.file.write(
-                    f'@SP\nAM=M-1\nD=M\n@{5+index}\nM=D\n'
-                )
-            elif segment == 'pointer':
-                if index == 0:
-                    self.file.write(
-                        f'@SP\nAM=M-1\nD=M\n@THIS\nM=D\n'
-                    )
-                elif index == 1:
-                    self.file.write(
-                        f'@SP\nAM=M-1\nD=M\n@THAT\nM=D\n'
-                    )
+        self._comment(f'{command} {segment} {index}')
+        if self.cache_top:
+            if command == 'push':
+                self._flush_top()
+                self._write(self._load_d(segment, index, file_name))
+                self.top_in_d = True
+                return
+            if self.top_in_d:
+                self._write(self._store_d(segment, index, file_name))
+                self.top_in_d = False
+                return
+        templates = PUSH_TEMPLATES if command == 'push' else POP_TEMPLATES
+        self._write(templates[segment].format(
+            index=index, file=file_name, address=5 + index, pointer='THAT' if index else 'THIS'
+        ))
 
+    # labels, jumps and calls name a label, so they are never taken from the memo; each of them
+    # is written with a single append, comment included
     def _write_label(self, label):
-        self.file.write(f'// label {label}\n')
-        self.file.write(f'({label})\n')
+        if self.top_in_d:
+            self._flush_top()
+        self._write(f'// label {label}\n({label})\n' if self.comments else f'({label})\n')
 
     def _write_goto(self, label):
-        self.file.write(f'// goto {label}\n')
-        self.file.write(f'@{label}\n0;JMP\n')
+        if self.top_in_d:
+            self._flush_top()
+        self._write(f'// goto {label}\n@{label}\n0;JMP\n' if self.comments else f'@{label}\n0;JMP\n')
 
     def _write_if_goto(self, label):
-        self.file.write(f'// if-goto {label}\n')
-        self.file.write(f'@SP\nAM=M-1\nD=M\n@{label}\nD;JNE\n')
+        if self.top_in_d:
+            self._write(f'// if-goto {label}\n@{label}\nD;JNE\n' if self.comments else f'@{label}\nD;JNE\n')
+            self.top_in_d = False
+        elif self.comments:
+            self._write(f'// if-goto {label}\n@SP\nAM=M-1\nD=M\n@{label}\nD;JNE\n')
+        else:
+            self._write(f'@SP\nAM=M-1\nD=M\n@{label}\nD;JNE\n')
 
     def _write_call(self, function_name, num_args):
         num_args = int(num_args)
-        return_address = f'{function_name}$ret.{self.label_counter}'
+        return_address = f'{function_name}$ret.{self._label_id(self.label_counter)}'
         self.label_counter += 1
-        self.file.write(f'// call {function_name} {num_args}\n')
-        self.file.write(f'@{return_address}\nD=A\n@SP\nA=M\nM=D\n@SP\nM=M+1\n') # push return address
-        self.file.write('@LCL\nD=M\n@SP\nA=M\nM=D\n@SP\nM=M+1\n') # push LCL
-        self.file.write('@ARG\nD=M\n@SP\nA=M\nM=D\n@SP\nM=M+1\n') # push ARG
-        self.file.write('@THIS\nD=M\n@SP\nA=M\nM=D\n@SP\nM=M+1\n') # push THIS
-        self.file.write('@THAT\nD=M\n@SP\nA=M\nM=D\n@SP\nM=M+1\n') # push THAT
-        self.file.write(f'@{num_args}\nD=A\n@5\nD=D+A\n@SP\nD=M-D\n@ARG\nM=D\n') # ARG = SP - 5 - nargs
-        self.file.write('@SP\nD=M\n@LCL\nM=D\n') # LCL = SP
-        self._write_goto(function_name)
-        self._write_label(return_address)
+        if self.top_in_d:
+            self._flush_top()
+        self._comment(f'call {function_name} {num_args}')
+        if self.compact:
+            self._write(f'@{function_name}\nD=A\n@R13\nM=D\n') # R13 = function
+            if num_args <= 1:
+                self._write(f'@R14\nM={num_args}\n') # R14 = nArgs
+            else:
+                self._write(f'@{num_args}\nD=A\n@R14\nM=D\n')
+            self._write(f'@{return_address}\nD=A\n@$$CALL\n0;JMP\n')
+            self._write_label(return_address)
+            return
+        self._write(
+            f'@{return_address}\nD=A\n{PUSH_D}{SAVE_FRAME}' # push return address, LCL, ARG, THIS, THAT
+            f'@{num_args}\nD=A\n@5\nD=D+A\n@SP\nD=M-D\n@ARG\nM=D\n' # ARG = SP - 5 - nargs
+            '@SP\nD=M\n@LCL\nM=D\n' # LCL = SP
+            + (f'// goto {function_name}\n@{function_name}\n0;JMP\n// label {return_address}\n({return_address})\n'
+               if self.comments else f'@{function_name}\n0;JMP\n({return_address})\n')
+        )
 
     def _write_function(self, function_name, num_vars):
-        self.file.write(f'// function {function_name} {num_vars}\n')
+        self._comment(f'function {function_name} {num_vars}')
         self._write_label(function_name)
-        for _ in range(int(num_vars)):
-            self._write_push_pop('push', 'constant', '0', '')
+        if self.cache_top:
+            for _ in range(int(num_vars)):
+                self._write_push_pop('push', 'constant', '0', '')
+        else:
+            self._write((PUSH_ZERO_COMMENTED if self.comments else PUSH_ZERO) * int(num_vars))
 
     def _write_return(self):
-        self.file.write('// return\n')
-        self.file.write('@LCL\nD=M\n@R13\nM=D\n') # end_frame (R13) = LCL
-        self.file.write('@5\nA=D-A\nD=M\n@R14\nM=D\n') # return_address (R14) = *(end_frame - 5)
-        self.file.write('@SP\nAM=M-1\nD=M\n@ARG\nA=M\nM=D\n') # *ARG = pop()
-        self.file.write('@ARG\nD=M+1\n@SP\nM=D\n') # SP = ARG + 1
-        self.file.write('@R13\nAM=M-1\nD=M\n@THAT\nM=D\n') # THAT = *(end_frame - 2)
-        self.file.write('@R13\nAM=M-1\nD=M\n@THIS\nM=D\n') # THIS = *(end_frame - 1)
-        self.file.write('@R13\nAM=M-1\nD=M\n@ARG\nM=D\n') # ARG = *(end_frame - 3)
-        self.file.write('@R13\nAM=M-1\nD=M\n@LCL\nM=D\n') # LCL = *(end_frame - 4)
-        self.file.write('@R14\nA=M\n0;JMP\n') # goto return_address
-
-    def write(self, parsed_lines):
-        self._write_bootstrap()
-        for file, lines in parsed_lines.items():
-            for line in lines:
-                line = line.split()
-                if len(line) == 1:
-                    command = line[0]
-                    if command == 'return':
-                        self._write_return()
-                    else:
-                        self._write_arithmetic(command)
-                elif len(line) == 2:
-                    command, label = line[0], line[1]
-                    if command == 'label':
-                        self._write_label(label)                    
-                    elif command == 'goto':
-                        self._write_goto(label)
-                    else:
-                        self._write_if_goto(label)
+        self._comment('return')
+        self._flush_top()
+        if self.compact:
+            self._write('@$$RETURN\n0;JMP\n')
+        else:
+            self._write_return_sequence()
+
+    def _write_return_sequence(self):
+        self._write('@LCL\nD=M\n@R13\nM=D\n') # end_frame (R13) = LCL
+        self._write('@5\nA=D-A\nD=M\n@R14\nM=D\n') # return_address (R14) = *(end_frame - 5)
+        self._write('@SP\nAM=M-1\nD=M\n@ARG\nA=M\nM=D\n') # *ARG = pop()
+        self._write('@ARG\nD=M+1\n@SP\nM=D\n') # SP = ARG + 1
+        self._write('@R13\nAM=M-1\nD=M\n@THAT\nM=D\n') # THAT = *(end_frame - 2)
+        self._write('@R13\nAM=M-1\nD=M\n@THIS\nM=D\n') # THIS = *(end_frame - 1)
+        self._write('@R13\nAM=M-1\nD=M\n@ARG\nM=D\n') # ARG = *(end_frame - 3)
+        self._write('@R13\nAM=M-1\nD=M\n@LCL\nM=D\n') # LCL = *(end_frame - 4)
+        self._write('@R14\nA=M\n0;JMP\n') # goto return_address
+
+    def _load_d(self, segment, index, file_name):
+        # assembly that sets D to the value of segment[index]
+        if segment == 'constant':
+            return f'@{index}\nD=A\n'
+        if segment in SEGMENT_BASE:
+            return f'@{SEGMENT_BASE[segment]}\nD=M\n@{index}\nA=D+A\nD=M\n'
+        return f'@{self._fixed_address(segment, index, file_name)}\nD=M\n'
+
+    def _store_d(self, segment, index, file_name):
+        # assembly that stores D into segment[index] without going through the stack
+        if segment not in SEGMENT_BASE:
+            return f'@{self._fixed_address(segment, index, file_name)}\nM=D\n'
+        base = SEGMENT_BASE[segment]
+        if index <= MAX_INCREMENTS:
+            return f'@{base}\nA=M\n' + 'A=A+1\n' * index + 'M=D\n'
+        return f'@R14\nM=D\n@{base}\nD=M\n@{index}\nD=D+A\n@R13\nM=D\n@R14\nD=M\n@R13\nA=M\nM=D\n'
+
+    def _fixed_address(self, segment, index, file_name):
+        # symbol or address of a static, temp or pointer cell
+        if segment == 'static':
+            return f'{file_name}.{index}'
+        if segment == 'temp':
+            return str(5 + index)
+        return 'THIS' if index == 0 else 'THAT'
+
+    def _write_fused(self, fused, file_name):
+        rule = fused[0]
+        if self.cache_top and rule != 'push-constant-if-goto':
+            # keeping the stack top in D saves the same round trips; one command at a time,
+            # the result also stays in D
+            for command in unfuse(fused):
+                self._write_command(command, file_name)
+            return
+        self._flush_top()
+        if rule == 'push-arith':
+            _, segment, index, op = fused
+            self._comment(f'push {segment} {index} + {op}')
+            self._write(self._load_d(segment, int(index), file_name))
+            self._write(f'@SP\nA=M-1\nM=M{BINARY_OP_SYMBOLS[op]}D\n')
+        elif rule == 'push-pop':
+            _, segment, index, pop_segment, pop_index = fused
+            pop_index = int(pop_index)
+            self._comment(f'push {segment} {index} + pop {pop_segment} {pop_index}')
+            if pop_segment in SEGMENT_BASE:
+                self._write(f'@{SEGMENT_BASE[pop_segment]}\nD=M\n@{pop_index}\nD=D+A\n@R13\nM=D\n')
+                self._write(self._load_d(segment, int(index), file_name))
+                self._write('@R13\nA=M\nM=D\n')
+            else:
+                self._write(self._load_d(segment, int(index), file_name))
+                self._write(f'@{self._fixed_address(pop_segment, pop_index, file_name)}\nM=D\n')
+        elif rule == 'push-constant-if-goto':
+            _, value, label = fused
+            self._comment(f'push constant {value} + if-goto {label}')
+            if int(value) != 0: # the condition is known at translation time
+                self._write(f'@{label}\n0;JMP\n')
+        elif rule == 'not-if-goto':
+            _, label = fused
+            self._comment(f'not + if-goto {label}')
+            self._write(f'@SP\nAM=M-1\nD=M+1\n@{label}\nD;JNE\n') # !x != 0 exactly when x != -1
+
+    def write_commands(self, file_name, lines):
+        if self.source_map:
+            self._write_mapped_commands(file_name, lines)
+            return
+        if self.peephole:
+            lines = optimize(lines, self.peephole, self.peephole_stats)
+        if self.cache_top:
+            self._write_top_cached_commands(file_name, lines)
+            return
+        lines = iter(lines)
+        buffer, translations = self.buffer, self.translations
+        # static symbols contain the file name, so those translations are only kept for this file
+        file_translations = {}
+        while True:
+            chunk = list(islice(lines, FLUSH_CHUNK))
+            if not chunk:
+                break
+            # look the whole chunk up at once, then go back for the commands that missed
+            texts = list(map(translations.get, chunk))
+            position = 0
+            while True:
+                try:
+                    miss = texts.index(None, position)
+                except ValueError:
+                    buffer.extend(texts[position:])
+                    break
+                buffer.extend(texts[position:miss])
+                line = chunk[miss]
+                text = file_translations.get(line)
+                if text is not None:
+                    buffer.append(text)
                 else:
-                    command, func_or_seg, val = line[0], line[1], line[2]
-                    if command == 'function':
-                        self._write_function(func_or_seg, val)
-                    elif command == 'call':
-                        self._write_call(func_or_seg, val)
+                    start = len(buffer)
+                    if self._write_command(line, file_name):
+                        text = ''.join(buffer[start:])
+                        if 'static' in line:
+                            file_translations[line] = text
+                        else:
+                            translations[line] = text
+                position = miss + 1
+            self.flush()
+
+    def _write_top_cached_commands(self, file_name, lines):
+        # with cache_top, the assembly of a command depends on whether the stack top is in D
+        # before it, and decides whether it is in D after it, so the memo is keyed by both
+        translations, file_translations = self.translations, {}
+        for line in lines:
+            key = (self.top_in_d, line)
+            entry = translations.get(key) or file_translations.get(key)
+            if entry is not None:
+                self._write(entry[0])
+                self.top_in_d = entry[1]
+            else:
+                start = len(self.buffer)
+                if self._write_command(line, file_name):
+                    entry = (''.join(self.buffer[start:]), self.top_in_d)
+                    if 'static' in line:
+                        file_translations[key] = entry
                     else:
-                        self._write_push_pop(command, func_or_seg, val, file)
+                        translations[key] = entry
+            if len(self.buffer) >= FLUSH_CHUNK:
+                self.flush()
+        self._flush_top()
+        self.flush()
+
+    def _write_mapped_commands(self, file_name, numbered_lines):
+        # numbered_lines are (line number, command) pairs; every command gets its marker, so
+        # nothing is taken from the memo. A fused pair is mapped to the line of its first command.
+        numbers = deque()
+        def commands():
+            for number, line in numbered_lines:
+                numbers.append(number)
+                yield line
+        lines = commands()
+        if self.peephole:
+            lines = optimize(lines, self.peephole, self.peephole_stats)
+        function_name = '-'
+        for line in lines:
+            number = numbers.popleft()
+            if isinstance(line, tuple):
+                numbers.popleft()
+                text = ' '.join(line)
+            else:
+                text = line
+                if line.startswith('function '):
+                    function_name = line.split()[1]
+            self._marker(file_name, number, function_name, text)
+            self._write_command(line, file_name)
+            if len(self.buffer) >= FLUSH_CHUNK:
+                self.flush()
+        self._flush_top()
+        self.flush()
+
+    def _write_command(self, line, file_name):
+        # writes one (possibly fused) command; returns whether its assembly goes into the memo
+        if isinstance(line, tuple):
+            self._write_fused(line, file_name)
+            return line[0] in MEMO_COMMANDS
+        line = line.split()
+        command = line[0]
+        if command == 'push' or command == 'pop':
+            self._write_push_pop(command, line[1], line[2], file_name)
+            return True
+        write = self.label_commands.get(command)
+        if write is not None:
+            write(*line[1:])
+            return False
+        if command == 'return':
+            self._write_return()
+        else:
+            self._write_arithmetic(command)
+        return command in MEMO_COMMANDS
+
+    def write(self, parsed_lines, bootstrap=True):
+        self.write_stream(parsed_lines.items(), bootstrap)
+
+    def write_stream(self, sources, bootstrap=True):
+        # sources is an iterable of (file name, commands) pairs; both the pairs and the commands
+        # are consumed lazily, so only the current chunk of one file is ever held in memory
+        if bootstrap:
+            self._write_bootstrap()
+        elif self.compact: # the shared routines are still needed, so jump over them
+            self._write('@$$START\n0;JMP\n')
+            self._write_runtime()
+            self._write('($$START)\n')
+        for file, lines in sources:
+            self.write_commands(file, lines)
+        self.flush()
 
     def close(self):
-        self.file.close()
+        self.flush()
+        if self.lines is None:
+            self.file.close()
 
-def handle_file(abs_path):
-    basename = os.path.basename(abs_path).split('.')[0]
+def handle_file(abs_path, **options):
     output_filename = os.path.splitext(abs_path)[0] + '.asm'
-    lines = {basename: read_file(abs_path)}
-    parsed_lines = parse_lines(lines)
-    code_writer = CodeWriter(output_filename)
-    code_writer.write(parsed_lines)
+    code_writer = CodeWriter(output_filename, **options)
+    code_writer.write_stream(stream_sources([abs_path], options.get('source_map', False)))
+    code_writer.close()
+    return output_filename, {'peephole': code_writer.peephole_stats}
+
+def handle_dir(abs_path, **options):
+    basename = os.path.basename(abs_path)
+    output_filename = abs_path + '/' + basename + '.asm'
+    code_writer = CodeWriter(output_filename, **options)
+    code_writer.write_stream(stream_sources(vm_files(abs_path), options.get('source_map', False)))
+    code_writer.close()
+    return output_filename, {'peephole': code_writer.peephole_stats}
+
+def handle_linked(abs_path, roots=ROOTS, **options):
+    # translates a file or a directory with only the functions reachable from roots; the whole
+    # program is read into memory first, as the call graph needs every file
+    if os.path.isfile(abs_path):
+        output_filename = os.path.splitext(abs_path)[0] + '.asm'
+        files = [abs_path]
+    else:
+        output_filename = abs_path + '/' + os.path.basename(abs_path) + '.asm'
+        files = vm_files(abs_path)
+    parsed_lines = {file_name: list(lines) for file_name, lines in stream_sources(files)}
+    kept, removed = eliminate_dead_functions(parsed_lines, roots)
+    code_writer = CodeWriter(output_filename, **options)
+    code_writer.write(kept)
+    code_writer.close()
+    report = []
+    for function_name, file_name, commands in removed:
+        # the size each removed function would have had in this output: translated on its own,
+        # with the same options as the rest of the program
+        counter = InstructionCounter()
+        CodeWriter(counter, **options).write_commands(file_name, iter(commands))
+        report.append((function_name, len(commands), counter.count))
+    return output_filename, {'peephole': code_writer.peephole_stats, 'removed': report}
+
+def handle_stream(input_file, output_file, file_name=STDIN_NAME, **options):
+    # translates VM commands read from an open text stream (e.g. sys.stdin) into another one
+    code_writer = CodeWriter(output_file, **options)
+    lines = number_lines(input_file) if options.get('source_map') else clean_lines(input_file)
+    code_writer.write_stream([(file_name, lines)])
+    return {'peephole': code_writer.peephole_stats}
+
+def translate_file_job(file, options):
+    # runs in a worker process: translates one file with its labels in the file's own namespace
+    file_basename = os.path.basename(file).split('.')[0]
+    buffer = io.StringIO()
+    code_writer = CodeWriter(buffer, label_namespace=file_basename, **options)
+    code_writer.write_commands(file_basename, stream_file(file))
+    return buffer.getvalue(), code_writer.peephole_stats
+
+def handle_dir_parallel(abs_path, workers=None, **options):
+    # same program as handle_dir, with every file translated in a worker process; the
+    # fragments are written after the bootstrap in vm_files order, whatever order they finish in
+    basename = os.path.basename(abs_path)
+    output_filename = abs_path + '/' + basename + '.asm'
+    files = vm_files(abs_path)
+    code_writer = CodeWriter(output_filename, **options)
+    code_writer._write_bootstrap()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for fragment, peephole_stats in executor.map(translate_file_job, files, [options] * len(files)):
+            code_writer.peephole_stats.update(peephole_stats)
+            code_writer._write(fragment)
+            code_writer.flush()
     code_writer.close()
+    return output_filename, {'peephole': code_writer.peephole_stats}
 
-def handle_dir(abs_path):
+def relocate(fragment, offset):
+    return RELOCATION_PATTERN.sub(lambda match: str(int(match.group(1)) + offset), fragment)
+
+def translate_fragment(file_name, lines, **options):
+    # translates a single file with label numbers starting at 0, in relocatable form
+    buffer = io.StringIO()
+    code_writer = CodeWriter(buffer, relocatable=True, **options)
+    code_writer.write_commands(file_name, number_lines(lines) if options.get('source_map') else clean_lines(lines))
+    return buffer.getvalue(), code_writer.label_counter, code_writer.peephole_stats
+
+def load_fragment(cache_dir, file, file_basename, **options):
+    # returns (fragment, label_count, peephole_stats, hit), translating and caching the file on a miss
+    with open(file, 'rb') as f:
+        source = f.read()
+    key = f'{TRANSLATOR_VERSION}\0{sorted(options.items())}\0{file_basename}\0'
+    key = hashlib.sha256(key.encode() + source).hexdigest()
+    cache_path = os.path.join(cache_dir, key + '.json')
+    try:
+        with open(cache_path, 'r') as f:
+            entry = json.load(f)
+        return entry['asm'], entry['labels'], Counter(entry['peephole']), True
+    except (OSError, ValueError, KeyError):
+        pass
+    fragment, label_count, peephole_stats = translate_fragment(file_basename, source.decode().splitlines(), **options)
+    os.makedirs(cache_dir, exist_ok=True)
+    temp_path = f'{cache_path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump({'asm': fragment, 'labels': label_count, 'peephole': peephole_stats}, f)
+    os.replace(temp_path, cache_path)
+    return fragment, label_count, peephole_stats, False
+
+def handle_dir_cached(abs_path, cache_dir=None, **options):
+    # same output as handle_dir, but each file's assembly is reused from the cache when the
+    # file content (and translator) is unchanged; only the label numbers are shifted into place
     basename = os.path.basename(abs_path)
     output_filename = abs_path + '/' + basename + '.asm'
-    file_list = os.listdir(abs_path) # list of all the files in this folder
-    files = [(abs_path + '/' + file) for file in file_list if file.endswith('.vm')]
-    lines = defaultdict(list)
+    cache_dir = cache_dir or os.path.join(abs_path, CACHE_DIR_NAME)
+    files = vm_files(abs_path)
+    code_writer = CodeWriter(output_filename, **options)
+    stats = {'hits': 0, 'misses': 0, 'peephole': code_writer.peephole_stats}
+    code_writer._write_bootstrap()
     for file in files:
-        temp_lines = read_file(file)
         file_basename = os.path.basename(file).split('.')[0]
-        lines[file_basename].extend(temp_lines)
-    parsed_lines = parse_lines(lines)
-    code_writer = CodeWriter(output_filename)
-    code_writer.write(parsed_lines)
+        fragment, label_count, peephole_stats, hit = load_fragment(cache_dir, file, file_basename, **options)
+        stats['hits' if hit else 'misses'] += 1
+        code_writer.peephole_stats.update(peephole_stats)
+        code_writer._write(relocate(fragment, code_writer.label_counter))
+        code_writer.label_counter += label_count
     code_writer.close()
+    return output_filename, stats
+
+def instruction_count(lines):
+    # number of ROM words, i.e. lines that are neither comments nor labels
+    count = 0
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith('//') and not line.startswith('('):
+            count += 1
+    return count
+
+def count_instructions(asm_filename):
+    with open(asm_filename, 'r') as file:
+        return instruction_count(file)
+
+class InstructionCounter:
+    # a text stream that counts the instructions written to it instead of keeping them
+    # (CodeWriter only writes whole lines)
+    def __init__(self):
+        self.count = 0
+
+    def write(self, text):
+        self.count += instruction_count(text.splitlines())
+
+    def close(self):
+        pass
+
+def translated_size(abs_path, **options):
+    # number of instructions abs_path translates to with options, counted in memory without
+    # writing an output file
+    files = [abs_path] if os.path.isfile(abs_path) else vm_files(abs_path)
+    counter = InstructionCounter()
+    CodeWriter(counter, **options).write_stream(stream_sources(files))
+    return counter.count
+
+def translate(abs_path, use_cache=False, workers=0, link=False, **options):
+    # returns (output_filename, stats); workers=None uses one worker process per core
+    if link:
+        return handle_linked(abs_path, **options)
+    if os.path.isfile(abs_path):
+        return handle_file(abs_path, **options)
+    if use_cache:
+        output_filename, stats = handle_dir_cached(abs_path, **options)
+        print(f"cache: {stats['hits']} hits, {stats['misses']} misses")
+        return output_filename, stats
+    if workers != 0:
+        return handle_dir_parallel(abs_path, workers, **options)
+    return handle_dir(abs_path, **options)
 
+def parse_flags(flags):
+    # returns (use_cache, workers, link, options) or None if a flag is not recognized
+    use_cache, workers, link, options = False, 0, False, {}
+    for flag in flags:
+        name, _, value = flag.partition('=')
+        if flag == '--cache':
+            use_cache = True
+        elif flag == '--link':
+            link = True
+        elif name == '--jobs':
+            if value and not value.isdigit():
+                return None
+            workers = int(value) if value else None
+        elif flag == '--compact':
+            options['compact'] = True
+        elif flag == '--no-comments':
+            options['comments'] = False
+        elif flag == '--map':
+            options['source_map'] = True
+        elif flag == '--cache-top':
+            options['cache_top'] = True
+        elif name == '--peephole':
+            rules = tuple(value.split(',')) if value else PEEPHOLE_RULES
+            if not set(rules) <= set(PEEPHOLE_RULES):
+                return None
+            options['peephole'] = rules
+        else:
+            return None
+    if link and (use_cache or workers != 0):
+        return None # dead-function elimination needs the whole program in one process
+    if options.get('source_map') and (use_cache or workers != 0 or link):
+        return None # these modes do not keep the line numbers
+    return use_cache, workers, link, options
 
 def main():
-    if len(sys.argv) != 2:
-        print("Usage:\npython3 vm_translator.py filename.asm\nOR\npython3 vm_translator.py path/to/folder")
+    args = sys.argv[1:]
+    flags = [arg for arg in args if arg.startswith('--')]
+    args = [arg for arg in args if not arg.startswith('--')]
+    parsed_flags = parse_flags(flags)
+    if len(args) != 1 or parsed_flags is None:
+        print("Usage:\npython3 vm_translator.py [--link] [options] filename.asm\nOR\npython3 vm_translator.py [--cache | --jobs[=N] | --link] [options] path/to/folder")
+        print("OR\npython3 vm_translator.py [options] - < input.vm > output.asm")
+        print("options: --compact, --no-comments, --map, --cache-top, --peephole[=" + ','.join(PEEPHOLE_RULES) + "]")
+        return
+    use_cache, workers, link, options = parsed_flags
+    ipt = args[0]
+    if ipt == '-':
+        handle_stream(sys.stdin, sys.stdout, **options)
         return
-    ipt = sys.argv[1]
     abs_path = os.path.abspath(ipt)
-    if os.path.isfile(abs_path):
-        handle_file(abs_path)
-    elif os.path.isdir(abs_path):
-        handle_dir(abs_path)
-    else:
+    if not os.path.exists(abs_path):
         print(f"no file or folder found: {ipt}")
+        return
+    # only the options that change the size of the program print it against the plain translation
+    report_size = link or any(options.get(option) for option in SIZE_OPTIONS)
+    output_filename, stats = translate(abs_path, use_cache, workers, link, **options)
+    if options.get('peephole'):
+        for rule in options['peephole']:
+            print(f"peephole {rule}: {stats['peephole'][rule]}")
+    if link:
+        for function_name, command_count, size in stats['removed']:
+            print(f"removed {function_name}: {command_count} VM commands, {size} instructions")
+        saved = sum(size for _, _, size in stats['removed'])
+        linked_size = count_instructions(output_filename)
+        print(f"removed {len(stats['removed'])} unreachable functions, {saved} instructions saved "
+              f"({linked_size + saved} -> {linked_size} with the same options)")
+    if report_size:
+        print(f"ROM size: {translated_size(abs_path)} instructions, "
+              f"{count_instructions(output_filename)} with {' '.join(flags)}")
 
 
 if __name__ == "__main__":